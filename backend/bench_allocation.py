@@ -0,0 +1,188 @@
+"""Concurrency stress benchmark for the spot allocation engine.
+
+Fires many concurrent bookings at a single lot through the
+/api/reserve-spot endpoint and verifies that no spot is ever handed out
+twice.
+
+By default it runs against a throwaway SQLite database. SQLite serializes
+writers, so there a claim never loses its race: contention shows up as
+"database is locked" errors instead. To exercise claim_spot's retry path,
+point --database-uri at an empty scratch database on a row-locking server;
+the benchmark creates its tables there and drops them afterwards.
+
+Usage (from the backend directory):
+    python bench_allocation.py --spots 200 --requests 2000 --workers 32
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+backend_dir = os.path.dirname(os.path.abspath(__file__))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Spot allocation stress benchmark')
+    parser.add_argument('--spots', type=int, default=200, help='spots in the benchmark lot')
+    parser.add_argument('--requests', type=int, default=2000, help='total booking attempts')
+    parser.add_argument('--workers', type=int, default=32, help='concurrent worker threads')
+    parser.add_argument('--churn', type=float, default=0.0,
+                        help='fraction of successful bookings released again immediately')
+    parser.add_argument('--max-retries', type=int, default=20,
+                        help='retries of a request answered with a 5xx before it counts as failed')
+    parser.add_argument('--database-uri',
+                        help='empty scratch database to run against instead of a throwaway SQLite file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    db_path = None
+    if args.database_uri:
+        os.environ['PARKWISE_DATABASE_URI'] = args.database_uri
+    else:
+        db_fd, db_path = tempfile.mkstemp(suffix='.db')
+        os.close(db_fd)
+        os.environ['PARKWISE_DATABASE_URI'] = f'sqlite:///{db_path}'
+
+    from flask_jwt_extended import create_access_token
+    from sqlalchemy import event
+    from main import app, db, User, ParkingLot, ParkingSpot, Reservation
+
+    with app.app_context():
+        if db.inspect(db.engine).get_table_names():
+            print("FAIL: the benchmark needs an empty database")
+            return 1
+        db.create_all()
+
+        # Every execution of claim_spot's conditional UPDATE (the only spot
+        # update with a candidate subquery) is one claim attempt, counted per
+        # thread since each worker serves its own requests
+        claim_attempts = threading.local()
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count_claim_attempts(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('UPDATE parking_spot') and 'SELECT' in statement:
+                claim_attempts.n = getattr(claim_attempts, 'n', 0) + 1
+
+        lot = ParkingLot(prime_location_name='Benchmark Lot', price=10.0,
+                         address='-', pin_code='000000', number_of_spots=args.spots,
+                         available_spots=args.spots)
+        db.session.add(lot)
+        db.session.flush()
+        db.session.add_all([ParkingSpot(lot_id=lot.id, spot_number=i) for i in range(1, args.spots + 1)])
+        db.session.add_all([User(username=f'bench{i}', email=f'bench{i}@example.com', role='user')
+                            for i in range(args.requests)])
+        db.session.commit()
+        lot_id = lot.id
+        tokens = {
+            u.id: create_access_token(identity=str(u.id), additional_claims={'role': 'user'})
+            for u in User.query.order_by(User.id).all()
+        }
+
+    def request_until_served(send):
+        """Call send() until the response is not a 5xx or max_retries is spent.
+
+        Returns (response, retries, contended) where contended counts the 503s
+        claim_spot gave after losing every race for a spot.
+        """
+        retries = contended = 0
+        while True:
+            response = send()
+            if response.status_code < 500 or retries == args.max_retries:
+                return response, retries, contended
+            # 503 when claim_spot lost every race, 500 for SQLite "database is locked"
+            contended += response.status_code == 503
+            retries += 1
+
+    lost_races = Counter()
+
+    def book(user_id):
+        """One booking attempt, returns (spot_number, retries, contended, failed)"""
+        client = app.test_client()
+        headers = {'Authorization': f'Bearer {tokens[user_id]}'}
+
+        def reserve():
+            claim_attempts.n = 0
+            response = client.post(
+                '/api/reserve-spot', json={'lot_id': lot_id, 'vehicle_number': f'BENCH-{user_id}'}, headers=headers
+            )
+            # Only the final attempt of a booking or of a full lot is not a lost race
+            lost_races[user_id] += max(claim_attempts.n - (response.status_code != 503), 0)
+            return response
+
+        response, retries, contended = request_until_served(reserve)
+        if response.status_code != 201:
+            return None, retries, contended, response.status_code >= 500
+
+        if args.churn and (user_id % 100) < args.churn * 100:
+            reservation_id = response.json['reservation_id']
+            release, release_retries, _ = request_until_served(lambda: client.put(
+                f'/api/release-spot/{reservation_id}', headers=headers
+            ))
+            retries += release_retries
+            if release.status_code >= 500:
+                return response.json['spot_number'], retries, contended, True
+        return response.json['spot_number'], retries, contended, False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(book, tokens))
+    elapsed = time.perf_counter() - start
+
+    claimed = [spot_number for spot_number, _, _, _ in results if spot_number is not None]
+    retries = sum(r for _, r, _, _ in results)
+    contended = sum(c for _, _, c, _ in results)
+    failed = sum(f for _, _, _, f in results)
+
+    with app.app_context():
+        active_per_spot = Counter(
+            spot_id for (spot_id,) in db.session.query(Reservation.spot_id).filter_by(status='active')
+        )
+        occupied = ParkingSpot.query.filter_by(lot_id=lot_id, status='O').count()
+        counter = db.session.get(ParkingLot, lot_id).available_spots
+
+    double_booked = {spot_id: n for spot_id, n in active_per_spot.items() if n > 1}
+
+    print(f"Attempts:         {args.requests} ({args.workers} workers)")
+    print(f"Successful:       {len(claimed)}")
+    print(f"Failed (5xx):     {failed} after {args.max_retries} retries each")
+    print(f"5xx retries:      {retries} ({contended} contended 503s)")
+    print(f"Lost claim races: {sum(lost_races.values())}")
+    print(f"Elapsed:          {elapsed:.2f}s ({args.requests / elapsed:.0f} req/s)")
+    print(f"Occupied spots:   {occupied}")
+    print(f"Active bookings:  {sum(active_per_spot.values())}")
+    print(f"Double bookings:  {len(double_booked)}")
+    print(f"Counter:          {counter} available (expected {args.spots - occupied})")
+
+    if db_path:
+        os.remove(db_path)
+    else:
+        with app.app_context():
+            db.drop_all()
+
+    if failed:
+        print("FAIL: requests kept failing with server errors")
+        return 1
+    if double_booked or occupied != sum(active_per_spot.values()):
+        print("FAIL: allocation is not exclusive")
+        return 1
+    if counter != args.spots - occupied:
+        print("FAIL: available_spots counter drifted from spot statuses")
+        return 1
+    if not args.churn and len(claimed) != min(args.spots, args.requests):
+        print("FAIL: spots left unallocated while bookings were refused")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,22 @@
-from celery import Celery
-from datetime import datetime, timedelta
+from celery import Celery, chord, group
+from celery.exceptions import Ignore
+from celery.signals import worker_process_init, worker_process_shutdown
+from datetime import datetime, timedelta, timezone
+from collections import Counter
+from functools import lru_cache
+import csv
+import gzip
+import importlib.util
+import io
+import itertools
+import json
+import math
+import shutil
+import time
 import smtplib
+import redis
+import requests
+from requests.adapters import HTTPAdapter
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
@@ -27,52 +43,222 @@ celery_app.conf.update(
 )
 
 # === Email configuration ===
+# Every setting can be overridden from the environment, e.g. to point the
+# workers at a local aiosmtpd stand-in: MAIL_SERVER=localhost MAIL_PORT=8025
+# MAIL_USE_TLS=0 MAIL_PASSWORD= (an empty password skips the login)
 MAIL_CONFIG = {
-    'MAIL_SERVER': 'smtp.gmail.com',
-    'MAIL_PORT': 587,
-    'MAIL_USERNAME': '<YOUR-EMAIL-ID-HERE>',
-    'MAIL_PASSWORD': '<YOUR-MAIL-PASSWORD-HERE>',
-    'MAIL_USE_TLS': True,
-    'GCHAT_WEBHOOK_URL': '<YOUR-GOOGLE-WEBHOOK-API-LINK>'
+    'MAIL_SERVER': os.environ.get('MAIL_SERVER', 'smtp.gmail.com'),
+    'MAIL_PORT': int(os.environ.get('MAIL_PORT', 587)),
+    'MAIL_USERNAME': os.environ.get('MAIL_USERNAME', '<YOUR-EMAIL-ID-HERE>'),
+    'MAIL_PASSWORD': os.environ.get('MAIL_PASSWORD', '<YOUR-MAIL-PASSWORD-HERE>'),
+    'MAIL_USE_TLS': os.environ.get('MAIL_USE_TLS', '1').lower() not in ('0', 'false', 'no'),
+    'GCHAT_WEBHOOK_URL': os.environ.get('GCHAT_WEBHOOK_URL', '<YOUR-GOOGLE-WEBHOOK-API-LINK>')
 }
 
+MAIL_BATCH_SIZE = 100  # Messages per send_email_batch task, all sent over one connection
+MAIL_MAX_MESSAGES_PER_CONNECTION = 500  # Servers cap how much one session may send
+MAIL_IDLE_CHECK = 60  # Seconds idle after which a pooled connection is probed with NOOP
+RECIPIENT_BATCH_SIZE = 1000  # Rows fetched per round trip while streaming recipients
+REPORT_BATCH_SIZE = 100  # Users per render_monthly_reports task
+
+GCHAT_DIGEST_LINES = 50  # Notification lines coalesced into one Google Chat message
+GCHAT_DIGEST_CHARS = 4000  # Chat rejects longer message texts
+GCHAT_TASK_DIGESTS = 20  # Digest messages posted per send_gchat_digest task
+GCHAT_MAX_RETRIES = 5  # Retries of a webhook post that was rate limited or failed
+GCHAT_MAX_BACKOFF = 30  # Seconds, cap on the wait between retries
+
+# === Export configuration ===
+# Export files are written here by the worker and served from here by the API,
+# so both must see the same directory
+EXPORT_DIR = os.environ.get(
+    'PARKWISE_EXPORT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exports')
+)
+EXPORT_TTL = 3600  # Seconds an export stays downloadable
+EXPORT_BATCH_SIZE = 1000  # Rows fetched per round trip while streaming an export
+EXPORT_PARTITION_ROWS = 50000  # Admin exports larger than this are split across tasks
+EXPORT_MAX_PARTS = 8  # Upper bound on the number of part tasks of one export
+EXPORT_ROW_GROUP_ROWS = 65536  # Rows buffered per Parquet row group / Arrow record batch
+# updated_at is stamped from the app clock at flush time, not at commit, so a
+# row can become visible with a timestamp older than rows already exported.
+# Watermarks stay this many seconds behind now, which must exceed the longest
+# write transaction plus any clock skew between app servers.
+EXPORT_WATERMARK_LAG = 60
+
+# Export formats: file extension, download mimetype and the optional package they need
+EXPORT_FORMATS = {
+    'csv': ('.csv', 'text/csv', None),
+    'csv.gz': ('.csv.gz', 'application/gzip', None),
+    'csv.zst': ('.csv.zst', 'application/zstd', 'zstandard'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet', 'pyarrow'),
+    'arrow': ('.arrow', 'application/vnd.apache.arrow.file', 'pyarrow'),
+}
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+
 # Helper functions
+class SMTPPool:
+    """Reusable authenticated SMTP connection, one per worker process"""
+
+    def __init__(self):
+        self.connection = None
+        self.sent = 0
+        self.used_at = 0.0
+
+    def connect(self):
+        connection = smtplib.SMTP(MAIL_CONFIG['MAIL_SERVER'], MAIL_CONFIG['MAIL_PORT'], timeout=30)
+        if MAIL_CONFIG['MAIL_USE_TLS']:
+            connection.starttls()
+        if MAIL_CONFIG['MAIL_USERNAME'] and MAIL_CONFIG['MAIL_PASSWORD']:
+            connection.login(MAIL_CONFIG['MAIL_USERNAME'], MAIL_CONFIG['MAIL_PASSWORD'])
+        self.connection = connection
+        self.sent = 0
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.connection = None
+
+    def alive(self):
+        try:
+            return self.connection.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, msg, retries=1):
+        """Send msg, reconnecting and retrying when the connection has gone bad"""
+        for attempt in range(retries + 1):
+            if self.connection is not None:
+                if self.sent >= MAIL_MAX_MESSAGES_PER_CONNECTION or (
+                        time.time() - self.used_at > MAIL_IDLE_CHECK and not self.alive()):
+                    self.close()
+            try:
+                if self.connection is None:
+                    self.connect()
+                self.connection.send_message(msg)
+                self.sent += 1
+                self.used_at = time.time()
+                return
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+                # Rejected message, the connection itself is fine
+                raise
+            except (smtplib.SMTPException, OSError):
+                self.close()
+                if attempt == retries:
+                    raise
+
+smtp_pool = SMTPPool()
+
+@worker_process_shutdown.connect
+def close_smtp_pool(**kwargs):
+    smtp_pool.close()
+
+def build_email(to_email, subject, body, is_html=False):
+    msg = MIMEMultipart()
+    msg['From'] = MAIL_CONFIG['MAIL_USERNAME']
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    
+    msg.attach(MIMEText(body, 'html' if is_html else 'plain'))
+    return msg
+
 def send_email(to_email, subject, body, is_html=False):
-    """Send email using SMTP"""
+    """Send email over the worker's pooled SMTP connection"""
     try:
-        msg = MIMEMultipart()
-        msg['From'] = MAIL_CONFIG['MAIL_USERNAME']
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        
-        msg.attach(MIMEText(body, 'html' if is_html else 'plain'))
-        
-        server = smtplib.SMTP(MAIL_CONFIG['MAIL_SERVER'], MAIL_CONFIG['MAIL_PORT'])
-        server.starttls()
-        server.login(MAIL_CONFIG['MAIL_USERNAME'], MAIL_CONFIG['MAIL_PASSWORD'])
-        text = msg.as_string()
-        server.sendmail(MAIL_CONFIG['MAIL_USERNAME'], to_email, text)
-        server.quit()
+        smtp_pool.send(build_email(to_email, subject, body, is_html))
         return True
     except Exception as e:
         print(f"Email sending failed: {e}")
         return False
 
-def send_gchat_message(message):
-    """Send message to Google Chat webhook"""
-    try:
-        import requests
-        webhook_url = MAIL_CONFIG.get('GCHAT_WEBHOOK_URL')
-        if not webhook_url:
-            print("Google Chat webhook URL not configured")
-            return False
-            
-        payload = {"text": message}
-        response = requests.post(webhook_url, json=payload)
-        return response.status_code == 200
-    except Exception as e:
-        print(f"Google Chat message failed: {e}")
-        return False
+def chunked(items, size):
+    """Lists of up to size items, pulled lazily so a streamed iterable is never held whole"""
+    items = iter(items)
+    while batch := list(itertools.islice(items, size)):
+        yield batch
+
+def fan_out(task, signatures, summary):
+    """Replace task with a chord of mail tasks that each return how many messages they sent.
+
+    The task's result becomes summary formatted with the total sent.
+    """
+    signatures = list(signatures)
+    if not signatures:
+        return summary.format(sent=0)
+    return task.replace(chord(group(signatures), summarize_mail_batches.s(summary)))
+
+@lru_cache(maxsize=None)
+def gchat_session():
+    """Keep-alive HTTP session for webhook posts, one per worker process"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def gchat_configured():
+    webhook_url = MAIL_CONFIG.get('GCHAT_WEBHOOK_URL')
+    return bool(webhook_url) and not webhook_url.startswith('<')
+
+def post_gchat(text, retries=GCHAT_MAX_RETRIES):
+    """Post text to the Google Chat webhook, waiting out rate limits and server errors"""
+    for attempt in range(retries + 1):
+        try:
+            response = gchat_session().post(MAIL_CONFIG['GCHAT_WEBHOOK_URL'], json={"text": text}, timeout=10)
+        except requests.RequestException as e:
+            print(f"Google Chat message failed: {e}")
+            response = None
+        
+        if response is not None:
+            if response.status_code == 200:
+                return True
+            if response.status_code != 429 and response.status_code < 500:
+                print(f"Google Chat message rejected: {response.status_code} {response.text[:200]}")
+                return False
+        
+        if attempt == retries:
+            break
+        delay = min(2 ** attempt, GCHAT_MAX_BACKOFF)
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            delay = min(int(response.headers['Retry-After']), GCHAT_MAX_BACKOFF)
+        time.sleep(delay)
+    
+    print(f"Google Chat message dropped after {retries + 1} attempts")
+    return False
+
+def build_digests(title, lines):
+    """Coalesce notification lines into message texts of at most GCHAT_DIGEST_LINES lines"""
+    digests = []
+    current = []
+    size = len(title)
+    for line in lines:
+        if current and (len(current) >= GCHAT_DIGEST_LINES or size + len(line) + 1 > GCHAT_DIGEST_CHARS):
+            digests.append(current)
+            current = []
+            size = len(title)
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        digests.append(current)
+    
+    if len(digests) == 1:
+        return [title + "\n" + "\n".join(digests[0])]
+    return [
+        f"{title} ({i}/{len(digests)})\n" + "\n".join(digest)
+        for i, digest in enumerate(digests, 1)
+    ]
+
+def queue_gchat_digest(title, lines):
+    """Hand notification lines to send_gchat_digest tasks, never waits on the webhook.
+
+    The digests are built here so their (i/n) numbering runs across the whole
+    notification rather than restarting in every task.
+    """
+    if not lines or not gchat_configured():
+        return
+    for batch in chunked(build_digests(title, lines), GCHAT_TASK_DIGESTS):
+        send_gchat_digest.delay(batch)
 
 # Seperate Flask app and database models created for Celery tasks to fix module import issues
 def create_flask_app():
@@ -82,7 +268,7 @@ def create_flask_app():
     from datetime import datetime
     
     app = Flask(__name__)
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///parking_app.db'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('PARKWISE_DATABASE_URI', 'sqlite:///parking_app.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
     db = SQLAlchemy(app)
@@ -123,215 +309,785 @@ def create_flask_app():
         parking_cost = db.Column(db.Float)
         status = db.Column(db.String(20), default='active')
         vehicle_number = db.Column(db.String(20))
+        base_cost = db.Column(db.Float, default=0.0)
+        hourly_rate = db.Column(db.Float, default=0.0)
+        total_hours = db.Column(db.Float, default=0.0)
+        cost_breakdown = db.Column(db.Text)
+        updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     return app, db, User, ParkingLot, ParkingSpot, Reservation
 
+# === Export helpers ===
+ADMIN_EXPORT_HEADER = [
+    'Reservation ID', 'User ID', 'Username', 'Email', 'Spot Number', 
+    'Lot Name', 'Lot Address', 'Vehicle Number', 'Parking Time', 
+    'Leaving Time', 'Duration (Hours)', 'Base Cost', 'Hourly Rate', 
+    'Total Cost', 'Status'
+]
+
+USER_EXPORT_HEADER = [
+    'Reservation ID', 'Spot Number', 'Lot Name', 'Lot Address', 
+    'Vehicle Number', 'Parking Time', 'Leaving Time', 
+    'Duration (Hours)', 'Base Cost', 'Hourly Rate', 'Total Cost', 'Status'
+]
+
+def export_query(db, User, ParkingLot, ParkingSpot, Reservation, user_id=None):
+    """Flat column select of the export rows, all reservations when user_id is None"""
+    query = db.select(
+        Reservation.id,
+        Reservation.user_id,
+        User.username,
+        User.email,
+        ParkingSpot.spot_number,
+        ParkingLot.prime_location_name,
+        ParkingLot.address,
+        ParkingLot.price,
+        Reservation.vehicle_number,
+        Reservation.parking_timestamp,
+        Reservation.leaving_timestamp,
+        Reservation.parking_cost,
+        Reservation.cost_breakdown,
+        Reservation.status,
+        Reservation.updated_at
+    ).join(
+        ParkingSpot, Reservation.spot_id == ParkingSpot.id
+    ).join(
+        ParkingLot, ParkingSpot.lot_id == ParkingLot.id
+    ).join(
+        User, Reservation.user_id == User.id
+    ).order_by(Reservation.id)
+
+    if user_id is not None:
+        query = query.where(Reservation.user_id == user_id)
+    return query
+
+def export_format_available(export_format):
+    """Whether export_format is known and its optional package is installed"""
+    if export_format not in EXPORT_FORMATS:
+        return False
+    package = EXPORT_FORMATS[export_format][2]
+    return package is None or importlib.util.find_spec(package) is not None
+
+def export_values(row, now):
+    """Typed leaving time, duration and costs of an export_query row"""
+    leaving_timestamp = row.leaving_timestamp
+    duration = ((leaving_timestamp or now) - row.parking_timestamp).total_seconds() / 3600
+
+    base_cost = row.parking_cost or 0
+    hourly_rate = row.price
+    total_cost = row.parking_cost or 0
+
+    if row.cost_breakdown:
+        try:
+            breakdown = json.loads(row.cost_breakdown)
+            base_cost = breakdown.get('base_cost', base_cost)
+            hourly_rate = breakdown.get('hourly_rate', hourly_rate)
+            total_cost = breakdown.get('total_cost', total_cost)
+        except (ValueError, AttributeError):
+            pass
+
+    return leaving_timestamp, duration, float(base_cost), float(hourly_rate), float(total_cost)
+
+def export_row(row, is_admin, now):
+    """One CSV row for an export_query row"""
+    leaving_timestamp, duration, base_cost, hourly_rate, total_cost = export_values(row, now)
+    if leaving_timestamp:
+        duration_str = f"{duration:.2f}"
+        leaving_time = leaving_timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        duration_str = f"{duration:.2f} (Active)"
+        leaving_time = 'Active'
+
+    columns = [
+        row.id,
+        row.spot_number,
+        row.prime_location_name,
+        row.address,
+        row.vehicle_number,
+        row.parking_timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        leaving_time,
+        duration_str,
+        f"{base_cost:.2f}",
+        f"{hourly_rate:.2f}",
+        f"{total_cost:.2f}",
+        row.status
+    ]
+    if is_admin:
+        columns[1:1] = [row.user_id, row.username, row.email]
+    return columns
+
+def export_schema(is_admin):
+    """Arrow schema of the columnar exports; leaving_time is null while active"""
+    import pyarrow as pa
+
+    fields = [('reservation_id', pa.int64())]
+    if is_admin:
+        fields += [('user_id', pa.int64()), ('username', pa.string()), ('email', pa.string())]
+    fields += [
+        ('spot_number', pa.int32()),
+        ('lot_name', pa.string()),
+        ('lot_address', pa.string()),
+        ('vehicle_number', pa.string()),
+        ('parking_time', pa.timestamp('us')),
+        ('leaving_time', pa.timestamp('us')),
+        ('duration_hours', pa.float64()),
+        ('base_cost', pa.float64()),
+        ('hourly_rate', pa.float64()),
+        ('total_cost', pa.float64()),
+        ('status', pa.string()),
+        ('updated_at', pa.timestamp('us'))
+    ]
+    return pa.schema(fields)
+
+def export_record(row, is_admin, now):
+    """One columnar export record for an export_query row"""
+    leaving_timestamp, duration, base_cost, hourly_rate, total_cost = export_values(row, now)
+    record = {'reservation_id': row.id}
+    if is_admin:
+        record.update(user_id=row.user_id, username=row.username, email=row.email)
+    record.update(
+        spot_number=row.spot_number,
+        lot_name=row.prime_location_name,
+        lot_address=row.address,
+        vehicle_number=row.vehicle_number,
+        parking_time=row.parking_timestamp,
+        leaving_time=leaving_timestamp,
+        duration_hours=duration,
+        base_cost=base_cost,
+        hourly_rate=hourly_rate,
+        total_cost=total_cost,
+        status=row.status,
+        updated_at=row.updated_at
+    )
+    return record
+
+class CsvExportWriter:
+    """Writes export rows as plain, gzip or zstd compressed CSV"""
+
+    def __init__(self, path, export_format, is_admin, header=True):
+        self.is_admin = is_admin
+        if export_format == 'csv.gz':
+            self.output = gzip.open(path, 'wt', newline='', encoding='utf-8')
+        elif export_format == 'csv.zst':
+            import zstandard
+            stream = zstandard.ZstdCompressor().stream_writer(open(path, 'wb'))
+            self.output = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        else:
+            self.output = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.output)
+        if header:
+            self.writer.writerow(ADMIN_EXPORT_HEADER if is_admin else USER_EXPORT_HEADER)
+
+    def write(self, rows, now):
+        self.writer.writerows(export_row(row, self.is_admin, now) for row in rows)
+
+    def close(self):
+        self.output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ArrowExportWriter:
+    """Writes export rows as typed columns to a Parquet or Arrow IPC file"""
+
+    def __init__(self, path, export_format, is_admin):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.is_admin = is_admin
+        self.schema = export_schema(is_admin)
+        if export_format == 'parquet':
+            self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+        else:
+            self.writer = pa.ipc.new_file(path, self.schema)
+        self.pending = []
+
+    def write(self, rows, now):
+        self.pending.extend(export_record(row, self.is_admin, now) for row in rows)
+        if len(self.pending) >= EXPORT_ROW_GROUP_ROWS:
+            self.flush()
+
+    def write_table(self, table):
+        self.flush()
+        self.writer.write_table(table)
+
+    def flush(self):
+        import pyarrow as pa
+
+        if self.pending:
+            self.writer.write_table(pa.Table.from_pylist(self.pending, schema=self.schema))
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_export_writer(path, export_format, is_admin, header=True):
+    """Writer for one export file, header only applies to the CSV formats"""
+    if export_format in COLUMNAR_FORMATS:
+        return ArrowExportWriter(path, export_format, is_admin)
+    return CsvExportWriter(path, export_format, is_admin, header)
+
+def cleanup_exports(max_age=EXPORT_TTL):
+    """Delete export files whose download key has expired"""
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def write_export_rows(db, query, writer, on_batch=None):
+    """Stream query rows into writer EXPORT_BATCH_SIZE at a time, returns the row count"""
+    now = datetime.utcnow()
+    written = 0
+    result = db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    for batch in result.partitions():
+        writer.write(batch, now)
+        written += len(batch)
+        if on_batch:
+            on_batch(written)
+    return written
+
+def export_header_bytes(header, export_format):
+    """The CSV header line as raw bytes, a compressed member of its own when needed"""
+    output = io.StringIO(newline='')
+    csv.writer(output).writerow(header)
+    data = output.getvalue().encode('utf-8')
+    if export_format == 'csv.gz':
+        return gzip.compress(data)
+    if export_format == 'csv.zst':
+        import zstandard
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+def merge_export_files(part_paths, path, export_format):
+    """Combine the part files of an admin export, in order, into path"""
+    if export_format in COLUMNAR_FORMATS:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        with open_export_writer(path, export_format, True) as writer:
+            for part_path in part_paths:
+                if export_format == 'parquet':
+                    batches = pq.ParquetFile(part_path).iter_batches()
+                else:
+                    reader = pa.ipc.open_file(part_path)
+                    batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+                for batch in batches:
+                    writer.write_table(pa.Table.from_batches([batch], schema=writer.schema))
+        return
+
+    # Gzip members and zstd frames may simply be concatenated
+    with open(path, 'wb') as output:
+        output.write(export_header_bytes(ADMIN_EXPORT_HEADER, export_format))
+        for part_path in part_paths:
+            with open(part_path, 'rb') as part_file:
+                shutil.copyfileobj(part_file, output)
+
+def export_partitions(db, Reservation, total, parts):
+    """[low, high) reservation id ranges holding about total / parts rows each"""
+    bounds = [None]
+    for i in range(1, parts):
+        bounds.append(db.session.execute(
+            db.select(Reservation.id).order_by(Reservation.id).offset(i * total // parts).limit(1)
+        ).scalar())
+    bounds.append(None)
+    return list(zip(bounds, bounds[1:]))
+
+def encode_watermark(updated_at, reservation_id):
+    return f"{updated_at.isoformat()},{reservation_id}"
+
+def parse_watermark(watermark):
+    """(updated_at, reservation id) of an 'iso-timestamp,id' watermark, raises ValueError"""
+    timestamp, _, reservation_id = str(watermark).partition(',')
+    updated_at = datetime.fromisoformat(timestamp)
+    if updated_at.tzinfo:
+        # Stored timestamps are naive UTC
+        updated_at = updated_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return updated_at, int(reservation_id or 0)
+
+def export_progress_key(download_key):
+    return f"export:{download_key}:progress"
+
+def export_path(download_key, export_format):
+    return os.path.join(EXPORT_DIR, download_key + EXPORT_FORMATS[export_format][0])
+
+def register_export(redis_client, download_key, path, export_format, user_id, records_count):
+    """Publish a finished export file under its download key"""
+    extension, mimetype, _ = EXPORT_FORMATS[export_format]
+    redis_client.setex(f"export:{download_key}", EXPORT_TTL, json.dumps({
+        'path': path,
+        'filename': 'parking_data' + extension,
+        'format': export_format,
+        'mimetype': mimetype,
+        'user_id': user_id,
+        'records_count': records_count
+    }))
+
+# === Progress reporting ===
+PROGRESS_INTERVAL = 2.0  # Seconds between progress writes to the result backend
+PROGRESS_STEP = 5  # Percentage points that force a progress write sooner
+
+class ProgressReporter:
+    """Throttled PROGRESS updates carrying processed/total, throughput and ETA.
+
+    Maps processed/total onto the start..end percentage range and only writes
+    to the result backend once every PROGRESS_INTERVAL seconds or PROGRESS_STEP
+    points, so the number of writes does not grow with the number of items.
+    """
+
+    def __init__(self, task, total, start=0, end=100, task_id=None,
+                 interval=PROGRESS_INTERVAL, step=PROGRESS_STEP):
+        self.task = task
+        self.task_id = task_id
+        self.total = total
+        self.start = start
+        self.end = end
+        self.interval = interval
+        self.step = step
+        self.started_at = time.time()
+        self.reported_at = 0.0
+        self.reported_progress = None
+
+    def update(self, processed, force=False):
+        """Report processed items if due, returns whether a write happened"""
+        progress = self.start + int(processed / self.total * (self.end - self.start)) if self.total else self.end
+        now = time.time()
+        if not force and self.reported_progress is not None:
+            if progress - self.reported_progress < self.step and now - self.reported_at < self.interval:
+                return False
+            if progress == self.reported_progress:
+                return False
+
+        elapsed = now - self.started_at
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total - processed, 0)
+        self.task.update_state(task_id=self.task_id, state='PROGRESS', meta={
+            'progress': progress,
+            'processed': processed,
+            'total': self.total,
+            'rate': round(rate, 1),
+            'eta': round(remaining / rate, 1) if rate else None
+        })
+        self.reported_at = now
+        self.reported_progress = progress
+        return True
+
+# === Worker resources ===
+_worker_resources = {}
+
+def worker_cache():
+    """Per-process resource cache, emptied in a forked pool process so it never
+    reuses engine or Redis connections inherited from its parent"""
+    if _worker_resources.get('pid') != os.getpid():
+        _worker_resources.clear()
+        _worker_resources['pid'] = os.getpid()
+    return _worker_resources
+
+def worker_resources():
+    """This process's (app, db, User, ParkingLot, ParkingSpot, Reservation), built on first use"""
+    cache = worker_cache()
+    if 'models' not in cache:
+        cache['models'] = create_flask_app()
+    return cache['models']
+
+def worker_redis():
+    """This process's Redis client, sharing one connection pool across tasks"""
+    cache = worker_cache()
+    if 'redis' not in cache:
+        cache['redis'] = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+    return cache['redis']
+
+@worker_process_init.connect
+def init_worker_resources(**kwargs):
+    worker_resources()
+    worker_redis()
+
 @celery_app.task(bind=True)
-def export_user_data_csv(self, user_id):
-    """Export user parking data to CSV"""
+def export_user_data_csv(self, user_id, compress=False, export_format=None, since=None):
+    """Export user parking data as CSV or one of the other EXPORT_FORMATS.
+
+    With a since watermark only reservations created or changed after it are
+    exported. The result's next_watermark is the since of the next run; it lags
+    EXPORT_WATERMARK_LAG behind now, so an incremental run stops there and the
+    next run picks up the rest. Full exports include the newest rows as well,
+    so those are exported again by the run that follows.
+    """
     try:
-        app, db, User, ParkingLot, ParkingSpot, Reservation = create_flask_app()
+        export_format = export_format or ('csv.gz' if compress else 'csv')
+        if not export_format_available(export_format):
+            raise Exception(f"Export format {export_format} is not available")
+        
+        app, db, User, ParkingLot, ParkingSpot, Reservation = worker_resources()
         
         with app.app_context():
             self.update_state(state='PROGRESS', meta={'progress': 10})
             
-            import csv
-            import io
-            import json
-            import redis
-            
-            redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+            redis_client = worker_redis()
             
-            user = User.query.get(user_id)
+            user = db.session.get(User, int(user_id))
             if not user:
                 raise Exception(f"User with ID {user_id} not found")
             
-            if user.role == 'admin':
-                reservations = Reservation.query.join(ParkingSpot).join(ParkingLot).join(User).all()
-            else:
-                reservations = Reservation.query.filter_by(user_id=user_id).join(ParkingSpot).join(ParkingLot).all()
+            is_admin = user.role == 'admin'
+            query = export_query(db, User, ParkingLot, ParkingSpot, Reservation,
+                                 user_id=None if is_admin else user.id)
             
-            self.update_state(state='PROGRESS', meta={'progress': 30})
+            # Read before any rows, so changes made during the export are
+            # picked up again by the next incremental run
+            cutoff = datetime.utcnow() - timedelta(seconds=EXPORT_WATERMARK_LAG)
+            latest = db.select(Reservation.updated_at, Reservation.id).where(
+                Reservation.updated_at.isnot(None),
+                Reservation.updated_at <= cutoff
+            ).order_by(Reservation.updated_at.desc(), Reservation.id.desc()).limit(1)
+            if not is_admin:
+                latest = latest.where(Reservation.user_id == user.id)
+            latest = db.session.execute(latest).first()
+            next_watermark = encode_watermark(*latest) if latest else since
             
-            output = io.StringIO()
-            writer = csv.writer(output)
+            if since:
+                watermark = db.tuple_(Reservation.updated_at, Reservation.id)
+                query = query.where(watermark > parse_watermark(since))
+                if latest:
+                    query = query.where(watermark <= tuple(latest))
+                else:
+                    query = query.where(Reservation.updated_at <= cutoff)
             
-            if user.role == 'admin':
-                writer.writerow([
-                    'Reservation ID', 'User ID', 'Username', 'Email', 'Spot Number', 
-                    'Lot Name', 'Lot Address', 'Vehicle Number', 'Parking Time', 
-                    'Leaving Time', 'Duration (Hours)', 'Base Cost', 'Hourly Rate', 
-                    'Total Cost', 'Status'
-                ])
-            else:
-                writer.writerow([
-                    'Reservation ID', 'Spot Number', 'Lot Name', 'Lot Address', 
-                    'Vehicle Number', 'Parking Time', 'Leaving Time', 
-                    'Duration (Hours)', 'Base Cost', 'Hourly Rate', 'Total Cost', 'Status'
-                ])
+            total = db.session.execute(
+                db.select(db.func.count()).select_from(query.order_by(None).subquery())
+            ).scalar()
             
-            self.update_state(state='PROGRESS', meta={'progress': 50})
+            os.makedirs(EXPORT_DIR, exist_ok=True)
+            cleanup_exports()
             
-            for res in reservations:
-                try:
-                    if res.leaving_timestamp:
-                        duration = (res.leaving_timestamp - res.parking_timestamp).total_seconds() / 3600
-                        duration_str = f"{duration:.2f}"
-                        leaving_time = res.leaving_timestamp.strftime('%Y-%m-%d %H:%M:%S')
-                    else:
-                        duration = (datetime.utcnow() - res.parking_timestamp).total_seconds() / 3600
-                        duration_str = f"{duration:.2f} (Active)"
-                        leaving_time = 'Active'
-                    
-                    base_cost = res.parking_cost or 0
-                    hourly_rate = res.spot.lot.price
-                    
-                    if hasattr(res, 'cost_breakdown') and res.cost_breakdown:
-                        try:
-                            breakdown = json.loads(res.cost_breakdown)
-                            base_cost = breakdown.get('base_cost', base_cost)
-                            hourly_rate = breakdown.get('hourly_rate', hourly_rate)
-                            total_cost = breakdown.get('total_cost', res.parking_cost or 0)
-                        except:
-                            total_cost = res.parking_cost or 0
-                    else:
-                        total_cost = res.parking_cost or 0
-                    
-                    if user.role == 'admin':
-                        row = [
-                            res.id,
-                            res.user_id,
-                            res.user.username,
-                            res.user.email,
-                            res.spot.spot_number,
-                            res.spot.lot.prime_location_name,
-                            res.spot.lot.address,
-                            res.vehicle_number,
-                            res.parking_timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                            leaving_time,
-                            duration_str,
-                            f"{base_cost:.2f}",
-                            f"{hourly_rate:.2f}",
-                            f"{total_cost:.2f}",
-                            res.status
-                        ]
-                    else:
-                        row = [
-                            res.id,
-                            res.spot.spot_number,
-                            res.spot.lot.prime_location_name,
-                            res.spot.lot.address,
-                            res.vehicle_number,
-                            res.parking_timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                            leaving_time,
-                            duration_str,
-                            f"{base_cost:.2f}",
-                            f"{hourly_rate:.2f}",
-                            f"{total_cost:.2f}",
-                            res.status
-                        ]
-                    
-                    writer.writerow(row)
-                    
-                except Exception as row_error:
-                    print(f"Error processing reservation {res.id}: {row_error}")
-                    basic_row = [
-                        res.id,
-                        getattr(res.spot, 'spot_number', 'N/A'),
-                        getattr(res.spot.lot, 'prime_location_name', 'N/A'),
-                        res.vehicle_number or 'N/A',
-                        res.parking_timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                        leaving_time if 'leaving_time' in locals() else 'N/A',
-                        res.parking_cost or 0,
-                        res.status
-                    ]
-                    if user.role == 'admin':
-                        basic_row.insert(1, res.user_id)
-                        basic_row.insert(2, getattr(res.user, 'username', 'N/A'))
-                    writer.writerow(basic_row)
+            download_key = f"csv_export_{user_id}_{datetime.utcnow().timestamp()}"
             
-            self.update_state(state='PROGRESS', meta={'progress': 80})
+            # Large full admin exports are split into id ranges written by parallel
+            # part tasks; the merge task's result becomes this task's result
+            if is_admin and not since and total > EXPORT_PARTITION_ROWS:
+                parts = min(EXPORT_MAX_PARTS, math.ceil(total / EXPORT_PARTITION_ROWS))
+                redis_client.hset(export_progress_key(download_key), mapping={'total': total, 'written': 0})
+                redis_client.expire(export_progress_key(download_key), EXPORT_TTL)
+                print(f"Exporting {total} reservations in {parts} parts")
+                
+                return self.replace(chord(
+                    group(
+                        export_csv_part.s(download_key, index, low, high, export_format, self.request.id)
+                        for index, (low, high) in enumerate(export_partitions(db, Reservation, total, parts))
+                    ),
+                    merge_export_parts.s(download_key, export_format, user.id, user.role, next_watermark)
+                ))
             
-            csv_data = output.getvalue()
-            output.close()
+            path = export_path(download_key, export_format)
+            partial_path = path + '.part'
             
-            print(f"Generated CSV data length: {len(csv_data)} characters")
-            print(f"Number of reservations processed: {len(reservations)}")
+            progress = ProgressReporter(self, total, start=30, end=90)
+            progress.update(0)
             
-            if len(csv_data) < 100:
-                print("Warning: CSV data seems too small")
-                print(f"CSV content preview: {csv_data[:200]}")
+            # Rows are written straight to disk, so memory use does not grow
+            # with the export size
+            with open_export_writer(partial_path, export_format, is_admin) as writer:
+                written = write_export_rows(db, query, writer, progress.update)
+            progress.update(written, force=True)
+            os.replace(partial_path, path)
             
-            cache_key = f"csv_export_{user_id}_{datetime.utcnow().timestamp()}"
-            redis_client.setex(cache_key, 3600, json.dumps(csv_data))
+            print(f"Exported {written} reservations to {path}")
+            
+            register_export(redis_client, download_key, path, export_format, user.id, written)
             
             self.update_state(state='PROGRESS', meta={'progress': 100})
             
             return {
                 'status': 'completed', 
-                'download_key': cache_key,
-                'records_count': len(reservations),
-                'user_role': user.role
+                'download_key': download_key,
+                'records_count': written,
+                'user_role': user.role,
+                'since': since,
+                'next_watermark': next_watermark
             }
         
+    except Ignore:
+        # Raised by self.replace() once the partitioned export is handed over
+        raise
     except Exception as e:
         print(f"CSV export error: {str(e)}")
         self.update_state(state='FAILURE', meta={'error': str(e)})
         raise
 
+@celery_app.task(bind=True)
+def export_csv_part(self, download_key, index, low, high, export_format, parent_id):
+    """Write the reservations with low <= id < high of an admin export to a part file"""
+    app, db, User, ParkingLot, ParkingSpot, Reservation = worker_resources()
+    
+    with app.app_context():
+        redis_client = worker_redis()
+        progress_key = export_progress_key(download_key)
+        total = int(redis_client.hget(progress_key, 'total') or 0)
+        
+        query = export_query(db, User, ParkingLot, ParkingSpot, Reservation)
+        if low is not None:
+            query = query.where(Reservation.id >= low)
+        if high is not None:
+            query = query.where(Reservation.id < high)
+        
+        progress = ProgressReporter(self, total, start=10, end=90, task_id=parent_id)
+        reported = 0
+        
+        def report(written):
+            # Progress is summed over all parts and reported on the export task
+            nonlocal reported
+            done = redis_client.hincrby(progress_key, 'written', written - reported)
+            reported = written
+            progress.update(done)
+        
+        # Parts carry no CSV header, the merge writes it once
+        path = os.path.join(EXPORT_DIR, f"{download_key}.{index}.part")
+        with open_export_writer(path, export_format, True, header=False) as writer:
+            written = write_export_rows(db, query, writer, report)
+        
+        return {'path': path, 'records_count': written}
+
+@celery_app.task(bind=True)
+def merge_export_parts(self, parts, download_key, export_format, user_id, user_role, next_watermark=None):
+    """Combine the part files of an admin export into the final file"""
+    redis_client = worker_redis()
+    
+    path = export_path(download_key, export_format)
+    partial_path = path + '.part'
+    
+    merge_export_files([part['path'] for part in parts], partial_path, export_format)
+    os.replace(partial_path, path)
+    
+    for part in parts:
+        os.remove(part['path'])
+    
+    written = sum(part['records_count'] for part in parts)
+    print(f"Exported {written} reservations to {path} from {len(parts)} parts")
+    
+    register_export(redis_client, download_key, path, export_format, user_id, written)
+    redis_client.delete(export_progress_key(download_key))
+    
+    return {
+        'status': 'completed', 
+        'download_key': download_key,
+        'records_count': written,
+        'user_role': user_role,
+        'since': None,
+        'next_watermark': next_watermark
+    }
+
+# === Report rendering ===
+MONTHLY_REPORT_TEMPLATE = """
+<html>
+<body>
+    <h2>Monthly Parking Report for {{ username }}</h2>
+    <h3>Report Period: {{ period.start }} - {{ period.end }}</h3>
+
+    <div style="background-color: #f5f5f5; padding: 20px; margin: 20px 0;">
+        <h3>Summary</h3>
+        <ul>
+            <li><strong>Total Bookings:</strong> {{ total_bookings }}</li>
+            <li><strong>Total Cost:</strong> ${{ '%.2f' % total_cost }}</li>
+            <li><strong>Most Used Lot:</strong> {{ most_used_lot }}</li>
+            <li><strong>Average Cost per Booking:</strong> ${{ '%.2f' % (total_cost / total_bookings) }}</li>
+        </ul>
+    </div>
+
+    <h3>Booking Details</h3>
+    <table border="1" style="border-collapse: collapse; width: 100%;">
+        <tr style="background-color: #e0e0e0;">
+            <th>Date</th>
+            <th>Location</th>
+            <th>Spot</th>
+            <th>Vehicle</th>
+            <th>Cost</th>
+        </tr>
+        {%- for date, lot_name, spot_number, vehicle_number, cost in reservations %}
+        <tr>
+            <td>{{ date }}</td>
+            <td>{{ lot_name }}</td>
+            <td>{{ spot_number }}</td>
+            <td>{{ vehicle_number }}</td>
+            <td>${{ '%.2f' % cost }}</td>
+        </tr>
+        {%- endfor %}
+    </table>
+
+    <p style="margin-top: 30px;">
+        Thank you for using ParkWise!<br>
+        <strong>ParkWise Team</strong>
+    </p>
+</body>
+</html>
+"""
+
+@lru_cache(maxsize=None)
+def monthly_report_template():
+    """The report template, compiled once per worker process"""
+    from jinja2 import Environment
+
+    return Environment(autoescape=True).from_string(MONTHLY_REPORT_TEMPLATE)
+
+def render_monthly_report(report, period):
+    """Subject and HTML body of one user's report.
+
+    report is {'username', 'email', 'reservations': [[date, lot name, spot, vehicle, cost], ...]}
+    and period is {'month', 'start', 'end'} display strings.
+    """
+    reservations = report['reservations']
+    total_cost = sum(cost for *_, cost in reservations)
+    most_used_lot = Counter(row[1] for row in reservations).most_common(1)[0][0]
+
+    body = monthly_report_template().render(
+        username=report['username'],
+        period=period,
+        total_bookings=len(reservations),
+        total_cost=total_cost,
+        most_used_lot=most_used_lot,
+        reservations=reservations
+    )
+    return f"Monthly Parking Report - {period['month']}", body
+
+# === Recipient selection ===
+def reminder_recipients(db, User, Reservation):
+    """Regular users without an active reservation, as one anti-join.
+
+    Returns the recipient count and a stream of (id, username, email) rows.
+    """
+    has_active = db.exists().where(
+        Reservation.user_id == User.id,
+        Reservation.status == 'active'
+    )
+    query = db.select(User.id, User.username, User.email).where(
+        User.role == 'user',
+        ~has_active
+    )
+    total = db.session.execute(
+        db.select(db.func.count()).select_from(query.subquery())
+    ).scalar()
+    rows = db.session.execute(
+        query.order_by(User.id).execution_options(yield_per=RECIPIENT_BATCH_SIZE)
+    )
+    return total, rows
+
+def monthly_report_groups(db, User, ParkingLot, ParkingSpot, Reservation, start, end):
+    """Regular users' reservations parked between start and end, from one streamed join.
+
+    Returns the number of users with reservations and a stream of
+    (user row, [reservation rows]) groups in user order.
+    """
+    period = db.and_(
+        Reservation.parking_timestamp >= start,
+        Reservation.parking_timestamp <= end
+    )
+    total = db.session.execute(
+        db.select(db.func.count(db.distinct(Reservation.user_id))).join(
+            User, Reservation.user_id == User.id
+        ).where(User.role == 'user', period)
+    ).scalar()
+    rows = db.session.execute(
+        db.select(
+            User.id.label('user_id'),
+            User.username,
+            User.email,
+            Reservation.parking_timestamp,
+            Reservation.vehicle_number,
+            Reservation.parking_cost,
+            ParkingSpot.spot_number,
+            ParkingLot.prime_location_name
+        ).join(
+            User, Reservation.user_id == User.id
+        ).join(
+            ParkingSpot, Reservation.spot_id == ParkingSpot.id
+        ).join(
+            ParkingLot, ParkingSpot.lot_id == ParkingLot.id
+        ).where(
+            User.role == 'user', period
+        ).order_by(
+            Reservation.user_id, Reservation.parking_timestamp, Reservation.id
+        ).execution_options(yield_per=RECIPIENT_BATCH_SIZE)
+    )
+    groups = ((reservations[0], reservations) for reservations in (
+        list(group) for _, group in itertools.groupby(rows, key=lambda row: row.user_id)
+    ))
+    return total, groups
+
+def reminder_message(user):
+    """Daily reminder email for one recipient row"""
+    subject = "ParkWise Daily Reminder"
+    body = f"""
+                Hi {user.username},
+                
+                You don't have any active parking reservations today.
+                Don't forget to book a parking spot if you're planning to visit!
+                
+                Visit our app to make a reservation.
+                
+                Best regards,
+                ParkWise Team
+                """
+    return {'to': user.email, 'subject': subject, 'body': body, 'is_html': False}
+
 @celery_app.task(bind=True)
 def send_daily_reminders(self):
     """Send daily reminders to users"""
     try:
-        app, db, User, ParkingLot, ParkingSpot, Reservation = create_flask_app()
+        app, db, User, ParkingLot, ParkingSpot, Reservation = worker_resources()
         
         with app.app_context():
             self.update_state(state='PROGRESS', meta={'progress': 10})
             
-            users = User.query.filter_by(role='user').all()
-            sent_count = 0
+            user_count = db.session.execute(
+                db.select(db.func.count(User.id)).where(User.role == 'user')
+            ).scalar()
+            total, recipients = reminder_recipients(db, User, Reservation)
+            progress = ProgressReporter(self, total, start=10, end=50)
+            notifications = []
             
-            for i, user in enumerate(users):
-                active_reservations = Reservation.query.filter_by(
-                    user_id=user.id, status='active'
-                ).count()
-                
-                if active_reservations == 0:
-                    subject = "ParkWise Daily Reminder"
-                    body = f"""
-                    Hi {user.username},
-                    
-                    You don't have any active parking reservations today.
-                    Don't forget to book a parking spot if you're planning to visit!
-                    
-                    Visit our app to make a reservation.
-                    
-                    Best regards,
-                    ParkWise Team
-                    """
-                    
-                    if send_email(user.email, subject, body):
-                        sent_count += 1
-                        print(f"Reminder sent to {user.email}")
-                    
-                    gchat_message = f"Daily Reminder: {user.username} ({user.email}) has no active parking reservations."
-                    send_gchat_message(gchat_message)
-                
-                progress = int((i + 1) / len(users) * 90) + 10
-                self.update_state(state='PROGRESS', meta={'progress': progress})
+            def reminders():
+                count = 0
+                for count, user in enumerate(recipients, 1):
+                    yield reminder_message(user)
+                    notifications.append(f"{user.username} ({user.email})")
+                    progress.update(count)
+                progress.update(count, force=True)
             
-            self.update_state(state='PROGRESS', meta={'progress': 100})
-            return f"Reminders sent to {sent_count} users out of {len(users)}"
+            # Each send_email_batch signature is cut as soon as MAIL_BATCH_SIZE
+            # recipients have streamed in, rather than from a list of all messages
+            batches = [send_email_batch.s(batch) for batch in chunked(reminders(), MAIL_BATCH_SIZE)]
+            queue_gchat_digest("Daily Reminder: users with no active parking reservations", notifications)
+            
+            return fan_out(self, batches, f"Reminders sent to {{sent}} users out of {user_count}")
         
+    except Ignore:
+        raise
     except Exception as e:
         self.update_state(state='FAILURE', meta={'error': str(e)})
         raise
 
 @celery_app.task(bind=True)
-def generate_monthly_reports(self):
-    """Generate monthly activity reports"""
+def generate_monthly_reports(self, separate_delivery=False):
+    """Generate monthly activity reports.
+
+    With separate_delivery each batch is rendered first and then handed to a
+    send_email_batch task, instead of being sent by the rendering task.
+    """
     try:
-        app, db, User, ParkingLot, ParkingSpot, Reservation = create_flask_app()
+        app, db, User, ParkingLot, ParkingSpot, Reservation = worker_resources()
         
         with app.app_context():
             self.update_state(state='PROGRESS', meta={'progress': 10})
@@ -341,90 +1097,86 @@ def generate_monthly_reports(self):
             last_day_previous_month = first_day_current_month - timedelta(days=1)
             first_day_previous_month = last_day_previous_month.replace(day=1)
             
-            users = User.query.filter_by(role='user').all()
-            sent_count = 0
+            period = {
+                'month': last_day_previous_month.strftime('%B %Y'),
+                'start': first_day_previous_month.strftime('%B %d, %Y'),
+                'end': last_day_previous_month.strftime('%B %d, %Y')
+            }
             
-            for i, user in enumerate(users):
-                reservations = Reservation.query.filter(
-                    Reservation.user_id == user.id,
-                    Reservation.parking_timestamp >= first_day_previous_month,
-                    Reservation.parking_timestamp <= last_day_previous_month
-                ).all()
-                
-                if reservations:
-                    total_bookings = len(reservations)
-                    total_cost = sum(res.parking_cost or 0 for res in reservations)
-                    
-                    lot_usage = {}
-                    for res in reservations:
-                        lot_name = res.spot.lot.prime_location_name
-                        lot_usage[lot_name] = lot_usage.get(lot_name, 0) + 1
-                    
-                    most_used_lot = max(lot_usage.items(), key=lambda x: x[1])[0] if lot_usage else "None"
-                    
-                    subject = f"Monthly Parking Report - {last_day_previous_month.strftime('%B %Y')}"
-                    body = f"""
-                    <html>
-                    <body>
-                        <h2>Monthly Parking Report for {user.username}</h2>
-                        <h3>Report Period: {first_day_previous_month.strftime('%B %d, %Y')} - {last_day_previous_month.strftime('%B %d, %Y')}</h3>
-                        
-                        <div style="background-color: #f5f5f5; padding: 20px; margin: 20px 0;">
-                            <h3>Summary</h3>
-                            <ul>
-                                <li><strong>Total Bookings:</strong> {total_bookings}</li>
-                                <li><strong>Total Cost:</strong> ${total_cost:.2f}</li>
-                                <li><strong>Most Used Lot:</strong> {most_used_lot}</li>
-                                <li><strong>Average Cost per Booking:</strong> ${total_cost/total_bookings:.2f}</li>
-                            </ul>
-                        </div>
-                        
-                        <h3>Booking Details</h3>
-                        <table border="1" style="border-collapse: collapse; width: 100%;">
-                            <tr style="background-color: #e0e0e0;">
-                                <th>Date</th>
-                                <th>Location</th>
-                                <th>Spot</th>
-                                <th>Vehicle</th>
-                                <th>Cost</th>
-                            </tr>
-                    """
-                    
-                    for res in reservations:
-                        body += f"""
-                            <tr>
-                                <td>{res.parking_timestamp.strftime('%Y-%m-%d')}</td>
-                                <td>{res.spot.lot.prime_location_name}</td>
-                                <td>{res.spot.spot_number}</td>
-                                <td>{res.vehicle_number}</td>
-                                <td>${res.parking_cost:.2f}</td>
-                            </tr>
-                        """
-                    
-                    body += """
-                        </table>
-                        
-                        <p style="margin-top: 30px;">
-                            Thank you for using ParkWise!<br>
-                            <strong>ParkWise Team</strong>
-                        </p>
-                    </body>
-                    </html>
-                    """
-                    
-                    if send_email(user.email, subject, body, is_html=True):
-                        sent_count += 1
-                        print(f"Monthly report sent to {user.email}")
-                
-                progress = int((i + 1) / len(users) * 90) + 10
-                self.update_state(state='PROGRESS', meta={'progress': progress})
+            total, groups = monthly_report_groups(
+                db, User, ParkingLot, ParkingSpot, Reservation,
+                first_day_previous_month, last_day_previous_month
+            )
             
-            self.update_state(state='PROGRESS', meta={'progress': 100})
-            return f"Monthly reports sent to {sent_count} users"
+            # Only the raw report rows are collected here, rendering and sending
+            # happen in render_monthly_reports tasks of REPORT_BATCH_SIZE users.
+            # Each signature is cut as soon as its batch has streamed in.
+            progress = ProgressReporter(self, total, start=10, end=50)
+            
+            def reports():
+                count = 0
+                for count, (user, reservations) in enumerate(groups, 1):
+                    yield {
+                        'username': user.username,
+                        'email': user.email,
+                        'reservations': [
+                            [
+                                res.parking_timestamp.strftime('%Y-%m-%d'),
+                                res.prime_location_name,
+                                res.spot_number,
+                                res.vehicle_number,
+                                res.parking_cost or 0
+                            ]
+                            for res in reservations
+                        ]
+                    }
+                    progress.update(count)
+                progress.update(count, force=True)
+            
+            return fan_out(
+                self,
+                (render_monthly_reports.s(batch, period, separate_delivery)
+                 for batch in chunked(reports(), REPORT_BATCH_SIZE)),
+                "Monthly reports sent to {sent} users"
+            )
         
+    except Ignore:
+        raise
     except Exception as e:
         self.update_state(state='FAILURE', meta={'error': str(e)})
         raise
 
+@celery_app.task(bind=True)
+def send_email_batch(self, messages):
+    """Send a batch of messages over the pooled connection, returns how many went out"""
+    sent = 0
+    for message in messages:
+        if send_email(message['to'], message['subject'], message['body'], message.get('is_html', False)):
+            sent += 1
+        else:
+            print(f"Email to {message['to']} failed")
+    return sent
+
+@celery_app.task(bind=True)
+def render_monthly_reports(self, reports, period, separate_delivery=False):
+    """Render a batch of monthly reports and send them, returns how many went out"""
+    messages = []
+    for report in reports:
+        subject, body = render_monthly_report(report, period)
+        messages.append({'to': report['email'], 'subject': subject, 'body': body, 'is_html': True})
+    
+    if separate_delivery:
+        return self.replace(send_email_batch.s(messages))
+    return send_email_batch(messages)
+
+@celery_app.task(bind=True)
+def send_gchat_digest(self, digests):
+    """Post digest message texts to Google Chat, returns how many were posted"""
+    return sum(post_gchat(text) for text in digests)
+
+@celery_app.task
+def summarize_mail_batches(sent_counts, summary):
+    return summary.format(sent=sum(sent_counts))
+
 if __name__ == '__main__':
     celery_app.start()
@@ -1,12 +1,23 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file
 from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
+from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity, get_jwt
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import json
+import math
+import random
+import socket
+import threading
+import time
+import uuid
+import base64
+import bisect
+from collections import OrderedDict, namedtuple
+from functools import wraps
 import redis
 from flask_cors import CORS 
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import os
 
 app = Flask(__name__)
@@ -21,7 +32,7 @@ CORS(app,
 # === Configuration ===
 app.config.update(
     SECRET_KEY='your-secret-key-here',
-    SQLALCHEMY_DATABASE_URI='sqlite:///parking_app.db',
+    SQLALCHEMY_DATABASE_URI=os.environ.get('PARKWISE_DATABASE_URI', 'sqlite:///parking_app.db'),
     SQLALCHEMY_TRACK_MODIFICATIONS=False,
     JWT_SECRET_KEY='jwt-secret-string',
     JWT_ACCESS_TOKEN_EXPIRES=timedelta(hours=24),
@@ -35,7 +46,8 @@ from celery_app import celery_app
 # === Extensions ===
 db = SQLAlchemy(app)
 jwt = JWTManager(app)
-CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
+# This later registration is the one that serves /api/*
+CORS(app, resources={r"/api/*": {"origins": "*"}}, expose_headers=["X-Next-Cursor"], supports_credentials=True)
 redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
 
 
@@ -57,6 +69,7 @@ class ParkingLot(db.Model):
     address = db.Column(db.Text, nullable=False)
     pin_code = db.Column(db.String(10), nullable=False)
     number_of_spots = db.Column(db.Integer, nullable=False)
+    available_spots = db.Column(db.Integer, nullable=False, default=0)  # Maintained by claim_spot/free_spot
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     spots = db.relationship('ParkingSpot', backref='lot', lazy=True, cascade='all, delete-orphan')
 
@@ -67,6 +80,11 @@ class ParkingSpot(db.Model):
     status = db.Column(db.String(1), default='A')  # A-Available, O-Occupied
     reservations = db.relationship('Reservation', backref='spot', lazy=True, cascade='all, delete-orphan')
 
+    __table_args__ = (
+        # claim_spot: first available spot of a lot by number
+        db.Index('ix_parking_spot_lot_status', 'lot_id', 'status', 'spot_number'),
+    )
+
 class Reservation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     spot_id = db.Column(db.Integer, db.ForeignKey('parking_spot.id'), nullable=False)
@@ -80,6 +98,47 @@ class Reservation(db.Model):
     hourly_rate = db.Column(db.Float, default=0.0)
     total_hours = db.Column(db.Float, default=0.0)
     cost_breakdown = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Incremental export watermark
+
+    __table_args__ = (
+        db.Index('ix_reservation_user_status', 'user_id', 'status'),
+        db.Index('ix_reservation_spot_status', 'spot_id', 'status'),
+        # Active reservations are a small slice of the table: counted on the
+        # dashboard and looked up per user on every booking
+        db.Index('ix_reservation_active_user', 'user_id',
+                 sqlite_where=db.text("status = 'active'"),
+                 postgresql_where=db.text("status = 'active'")),
+        # Newest-first listings and their keyset cursor
+        db.Index('ix_reservation_parking_timestamp', 'parking_timestamp', 'id'),
+        # Incremental export watermark
+        db.Index('ix_reservation_updated_at', 'updated_at', 'id'),
+    )
+
+class StatRollup(db.Model):
+    """Booking and revenue totals per day or month, kept current by reserve/release"""
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(10), nullable=False)  # 'all', 'lot' or 'user'
+    scope_id = db.Column(db.Integer, nullable=False, default=0)  # lot or user id, 0 for 'all'
+    period = db.Column(db.String(5), nullable=False)  # 'day' or 'month'
+    period_start = db.Column(db.Date, nullable=False)
+    reservations = db.Column(db.Integer, nullable=False, default=0)  # Bookings started
+    completed = db.Column(db.Integer, nullable=False, default=0)  # Bookings released
+    revenue = db.Column(db.Float, nullable=False, default=0.0)  # Cost of released bookings
+
+    __table_args__ = (
+        db.UniqueConstraint('scope', 'scope_id', 'period', 'period_start', name='uq_stat_rollup'),
+    )
+
+class DurationRollup(db.Model):
+    """Count of a user's finished bookings per duration bucket (see DURATION_BUCKET_EDGES)"""
+    user_id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class SchemaMigration(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
 # === Utilities ===
@@ -96,10 +155,14 @@ def init_admin():
 
 def calculate_parking_cost(reservation, lot_price, leaving_time=None):
     """Calculate detailed parking cost breakdown"""
+    return build_cost_breakdown(lot_price, reservation.parking_timestamp, leaving_time)
+
+def build_cost_breakdown(lot_price, parking_time, leaving_time=None):
+    """Cost breakdown for a stay from parking_time to leaving_time (default now)"""
     if leaving_time is None:
         leaving_time = datetime.utcnow()
     
-    duration_hours = (leaving_time - reservation.parking_timestamp).total_seconds() / 3600
+    duration_hours = (leaving_time - parking_time).total_seconds() / 3600
     
     base_hours = 1.0
     base_cost = lot_price * base_hours
@@ -121,57 +184,1046 @@ def calculate_parking_cost(reservation, lot_price, leaving_time=None):
     
     return breakdown
 
+def current_role():
+    """Role of the authenticated user, read from the token claims.
+
+    Tokens issued before the role claim existed fall back to a user lookup.
+    """
+    role = get_jwt().get('role')
+    if role is None:
+        user = db.session.get(User, int(get_jwt_identity()))
+        role = user.role if user else None
+    return role
+
+def admin_required(error=None):
+    """jwt_required() that also rejects non-admin tokens with a 403 and the given body"""
+    error = error or {'message': 'Admin access required'}
+
+    def decorator(fn):
+        @wraps(fn)
+        @jwt_required()
+        def wrapper(*args, **kwargs):
+            if current_role() != 'admin':
+                return jsonify(error), 403
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def reservation_breakdown(res):
+    """Stored cost breakdown for a reservation, recalculated up to now while it is active"""
+    if res.cost_breakdown:
+        breakdown = json.loads(res.cost_breakdown)
+    else:
+        breakdown = {
+            'total_cost': res.parking_cost or 0,
+            'hourly_rate': res.hourly_rate or 0,
+            'total_hours': res.total_hours or 0
+        }
+
+    if res.status == 'active':
+        breakdown.update(calculate_parking_cost(res, res.hourly_rate))
+
+    return breakdown
+
+def encode_cursor(timestamp, row_id):
+    """Opaque keyset pagination cursor for a (timestamp, id) position"""
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor, raises ValueError on a malformed cursor"""
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor') from None
+
+# Rows fetched per round trip from the server-side cursor when streaming
+STREAM_BATCH_SIZE = 1000
+
+def stream_rows(query, serialize, mode):
+    """Stream query results without materialising them.
+
+    mode 'ndjson' emits one JSON document per line; 'json' emits a single JSON
+    array encoded incrementally. Rows are pulled STREAM_BATCH_SIZE at a time,
+    so memory stays flat however many rows match.
+    """
+    def generate():
+        rows = db.session.execute(query.statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+        chunk = []
+        first = True
+        if mode == 'json':
+            chunk.append('[')
+        for row in rows:
+            encoded = json.dumps(serialize(*row))
+            if mode == 'ndjson':
+                chunk.append(encoded + '\n')
+            else:
+                chunk.append(encoded if first else ',' + encoded)
+            first = False
+            if len(chunk) >= STREAM_BATCH_SIZE:
+                yield ''.join(chunk)
+                chunk = []
+        if mode == 'json':
+            chunk.append(']')
+        yield ''.join(chunk)
+
+    mimetype = 'application/x-ndjson' if mode == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+def requested_stream_mode():
+    """'ndjson' or 'json' when the client asked for a streamed listing, else None"""
+    mode = request.args.get('stream')
+    if mode in ('ndjson', 'json'):
+        return mode
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        return 'ndjson'
+    return None
+
+# Number of times claim_spot retries after losing a race for a candidate spot
+SPOT_CLAIM_RETRIES = 5
+# Lowest-numbered free spots a claim picks from at random, so concurrent
+# bookings of one lot spread out instead of all racing for the same spot
+SPOT_CLAIM_SPREAD = 16
+
+class SpotContention(Exception):
+    """claim_spot lost every race for a free spot, the booking can be retried"""
+
+ClaimedSpot = namedtuple('ClaimedSpot', 'id spot_number available_spots')
+FreedSpot = namedtuple('FreedSpot', 'lot_id available_spots')
+
+def claim_spot(lot_id):
+    """Atomically claim one of the lowest-numbered available spots in a lot.
+
+    The candidate lookup and the status flip run as one conditional UPDATE, so
+    two concurrent bookings can never be handed the same spot. The candidate is
+    drawn at random from the first SPOT_CLAIM_SPREAD free spots, so concurrent
+    bookings mostly pick different spots. The lot's available_spots counter is
+    decremented in the same transaction. Returns a ClaimedSpot carrying the
+    lot's new counter, or None when the lot is full. Raises SpotContention when
+    spots are free but every attempt lost its race.
+    """
+    from sqlalchemy import func
+
+    # Aliased so the subquery is not correlated against the UPDATE target
+    free = db.aliased(ParkingSpot)
+    lowest_free = db.select(free.id).where(
+        free.lot_id == lot_id,
+        free.status == 'A'
+    ).order_by(free.spot_number).limit(SPOT_CLAIM_SPREAD).subquery()
+    candidate = db.select(lowest_free.c.id).order_by(func.random()).limit(1).scalar_subquery()
+
+    stmt = db.update(ParkingSpot).where(
+        ParkingSpot.id == candidate,
+        ParkingSpot.status == 'A'
+    ).values(status='O').returning(
+        ParkingSpot.id, ParkingSpot.spot_number
+    ).execution_options(synchronize_session=False)
+
+    for _ in range(SPOT_CLAIM_RETRIES):
+        claimed = db.session.execute(stmt).first()
+        if claimed:
+            available = adjust_available_spots(lot_id, -1)
+            return ClaimedSpot(claimed.id, claimed.spot_number, available)
+
+        # Nothing claimed: either the lot is full or another request won the
+        # candidate between our lookup and update, in which case try again.
+        if not db.session.query(ParkingSpot.id).filter_by(lot_id=lot_id, status='A').first():
+            return None
+
+    raise SpotContention(f"No spot of lot {lot_id} claimed after {SPOT_CLAIM_RETRIES} attempts")
+
+def free_spot(spot_id):
+    """Return an occupied spot to the available pool.
+
+    Returns a FreedSpot with the lot id and its new counter if the spot was
+    occupied, otherwise None.
+    """
+    freed = db.session.execute(
+        db.update(ParkingSpot).where(
+            ParkingSpot.id == spot_id,
+            ParkingSpot.status == 'O'
+        ).values(status='A').returning(
+            ParkingSpot.lot_id
+        ).execution_options(synchronize_session=False)
+    ).first()
+
+    if not freed:
+        return None
+    available = adjust_available_spots(freed.lot_id, 1)
+    return FreedSpot(freed.lot_id, available)
+
+def adjust_available_spots(lot_id, delta):
+    """Apply a relative change to a lot's available_spots counter and return the new value"""
+    return db.session.execute(
+        db.update(ParkingLot).where(
+            ParkingLot.id == lot_id
+        ).values(
+            available_spots=ParkingLot.available_spots + delta
+        ).returning(
+            ParkingLot.available_spots
+        ).execution_options(synchronize_session=False)
+    ).scalar()
+
 def get_cache_key(prefix, *args):
     return f"{prefix}:{'_'.join(map(str, args))}"
 
-def cache_get(key):
+# === In-process cache ===
+class LocalCache:
+    """Bounded LRU cache with per-entry TTL, shared by the threads of one worker"""
+
+    def __init__(self, maxsize=1024, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+local_cache = LocalCache(maxsize=1024, ttl=30)
+
+# Every worker drops its local copy of a key when another worker publishes
+# "<worker id> <key>" here; a key of '*' clears the whole local cache.
+CACHE_INVALIDATION_CHANNEL = 'parkwise:cache-invalidate'
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _listen_for_invalidations():
+    own_id = worker_id()
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                origin, _, key = message['data'].partition(' ')
+                if origin == own_id:
+                    continue
+                if key == '*':
+                    local_cache.clear()
+                else:
+                    local_cache.delete(key)
+        except redis.RedisError:
+            # Invalidations may have been missed while disconnected
+            local_cache.clear()
+            time.sleep(1)
+
+def ensure_invalidation_listener():
+    """Start the pub/sub listener thread once per worker process"""
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        # Threads do not survive a fork, so a pre-forked worker starts its own
+        if _listener_pid == os.getpid():
+            return
+        threading.Thread(target=_listen_for_invalidations, daemon=True).start()
+        _listener_pid = os.getpid()
+
+def broadcast_invalidation(key):
+    """Drop a key from this worker's local cache and tell the other workers to do the same"""
+    if key == '*':
+        local_cache.clear()
+    else:
+        local_cache.delete(key)
+    try:
+        redis_client.publish(CACHE_INVALIDATION_CHANNEL, f"{worker_id()} {key}")
+    except redis.RedisError:
+        pass
+
+def cache_get(key, local=False):
+    if local:
+        ensure_invalidation_listener()
+        data = local_cache.get(key)
+        if data is not None:
+            return data
     try:
         data = redis_client.get(key)
-        return json.loads(data) if data else None
+        data = json.loads(data) if data else None
     except:
         return None
+    if local and data is not None:
+        local_cache.set(key, data)
+    return data
 
-def cache_set(key, data, expire=300):
+def cache_set(key, data, expire=300, local=False):
     try:
         redis_client.setex(key, expire, json.dumps(data))
     except:
         pass
+    if local:
+        broadcast_invalidation(key)
+        local_cache.set(key, data, expire)
 
-def migrate_existing_reservations():
-    """Migrate existing reservations to include cost breakdown"""
+def cache_delete(key, local=False):
     try:
-        db.session.execute(db.text("SELECT base_cost FROM reservation LIMIT 1"))
-        reservations = Reservation.query.filter(Reservation.cost_breakdown.is_(None)).all()
-    except Exception:
-        print("New columns not found in database. Skipping migration - will run after first restart.")
+        redis_client.delete(key)
+    except:
+        pass
+    if local:
+        broadcast_invalidation(key)
+
+# === Cache recomputation ===
+# Compare-and-delete so a caller never releases a lock that timed out and was
+# taken over by someone else.
+_release_cache_lock = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+def acquire_cache_lock(key, timeout=10):
+    """Try to take the recompute lock for a cache key.
+
+    Returns a token to pass to release_cache_lock, False if another caller
+    holds the lock, or None if Redis is unreachable (callers should proceed).
+    """
+    token = uuid.uuid4().hex
+    try:
+        if redis_client.set(get_cache_key('lock', key), token, nx=True, px=int(timeout * 1000)):
+            return token
+        return False
+    except redis.RedisError:
+        return None
+
+def release_cache_lock(key, token):
+    if not token:
         return
-    
-    for res in reservations:
-        if res.hourly_rate is None or res.hourly_rate == 0:
-            lot_price = res.spot.lot.price
-            res.hourly_rate = lot_price
-            res.base_cost = lot_price
-            
-            if res.leaving_timestamp:
-                breakdown = calculate_parking_cost(res, lot_price, res.leaving_timestamp)
-                res.total_hours = breakdown['total_hours']
-                res.cost_breakdown = json.dumps(breakdown)
-                res.parking_cost = breakdown['total_cost']
+    try:
+        _release_cache_lock(keys=[get_cache_key('lock', key)], args=[token])
+    except redis.RedisError:
+        pass
+
+def single_flight(key, load, compute, wait=2.0, lock_timeout=10):
+    """Run compute() in only one caller at a time for a cache key.
+
+    Callers that lose the race poll load() until the winner has published its
+    result, and compute it themselves if nothing shows up within `wait` seconds.
+    """
+    token = acquire_cache_lock(key, lock_timeout)
+    if token is not False:
+        try:
+            return compute()
+        finally:
+            release_cache_lock(key, token)
+
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        time.sleep(0.05)
+        value = load()
+        if value is not None:
+            return value
+    return compute()
+
+def cache_fetch(key, compute, expire=60, stale_ttl=300, beta=1.0, local=False):
+    """Read-through cache with stampede protection.
+
+    Values are stored with the time they took to compute. Readers refresh
+    probabilistically before expiry (XFetch, tuned by beta), only one caller
+    recomputes at a time, and everyone else keeps getting the previous value
+    for up to stale_ttl seconds past expiry while the refresh runs. With
+    local=True entries are also kept in the in-process cache.
+    """
+    def refresh():
+        started = time.time()
+        value = compute()
+        finished = time.time()
+        entry = {'value': value, 'delta': finished - started, 'expires': finished + expire}
+        cache_set(key, entry, expire + stale_ttl, local=local)
+        return entry
+
+    entry = cache_get(key, local=local)
+    if entry:
+        # 1 - random() keeps the argument to log in (0, 1]
+        early = entry['delta'] * beta * -math.log(1.0 - random.random())
+        if time.time() + early < entry['expires']:
+            return entry['value']
+
+        token = acquire_cache_lock(key)
+        if token is False:
+            return entry['value']
+        try:
+            return refresh()['value']
+        finally:
+            release_cache_lock(key, token)
+
+    return single_flight(key, lambda: cache_get(key, local=local), refresh)['value']
+
+# === Lot listing cache ===
+# The listing is cached per lot rather than as one blob: lot metadata lives in
+# one hash and availability in another, so writers patch single fields instead
+# of invalidating the whole listing.
+LOT_RECORDS_KEY = get_cache_key('parking_lots', 'records')
+LOT_AVAILABLE_KEY = get_cache_key('parking_lots', 'available')
+LOT_CACHE_BUILT_KEY = get_cache_key('parking_lots', 'built')
+LOT_CACHE_TTL = 3600
+# Availability is published as the absolute counter read back from the
+# database, so a lost or reordered write is corrected by the next booking. The
+# short TTL bounds how long a write lost to a Redis error, or raced by a
+# concurrent rebuild, can be served when no further bookings arrive.
+LOT_AVAILABLE_TTL = 60
+
+# Only publish availability for lots already in the cache, so a write racing
+# with uncache_lot cannot resurrect a deleted lot.
+_publish_lot_availability = redis_client.register_script("""
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    return redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+return nil
+""")
+
+def lot_record(lot):
+    return {
+        'id': lot.id,
+        'prime_location_name': lot.prime_location_name,
+        'price': lot.price,
+        'address': lot.address,
+        'pin_code': lot.pin_code,
+        'number_of_spots': lot.number_of_spots
+    }
+
+def load_lot_cache():
+    """Assemble the lot listing from the cache in one round trip, None if the cache is cold.
+
+    Lot records rarely change, so they are also held in the in-process cache
+    and only availability has to come from Redis on a local hit.
+    """
+    ensure_invalidation_listener()
+    records = local_cache.get(LOT_RECORDS_KEY)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.exists(LOT_CACHE_BUILT_KEY)
+        pipe.hgetall(LOT_AVAILABLE_KEY)
+        if records is None:
+            pipe.hgetall(LOT_RECORDS_KEY)
+        results = pipe.execute()
+    except redis.RedisError:
+        return None
+
+    built, available = results[0], results[1]
+    if not built:
+        return None
+
+    if records is None:
+        records = {lot_id: json.loads(raw) for lot_id, raw in results[2].items()}
+        local_cache.set(LOT_RECORDS_KEY, records)
+
+    lots_data = []
+    for lot_id, record in records.items():
+        if lot_id not in available:
+            return None
+        lots_data.append(dict(record, available_spots=int(available[lot_id])))
+
+    lots_data.sort(key=lambda record: record['id'])
+    return lots_data
+
+def rebuild_lot_cache():
+    """Load every lot from the database and repopulate the lot cache"""
+    records = {}
+    available = {}
+    lots_data = []
+    for lot in ParkingLot.query.order_by(ParkingLot.id).all():
+        record = lot_record(lot)
+        records[lot.id] = json.dumps(record)
+        available[lot.id] = lot.available_spots
+        lots_data.append(dict(record, available_spots=lot.available_spots))
+
+    try:
+        pipe = redis_client.pipeline()
+        pipe.delete(LOT_RECORDS_KEY, LOT_AVAILABLE_KEY, LOT_CACHE_BUILT_KEY)
+        if lots_data:
+            pipe.hset(LOT_RECORDS_KEY, mapping=records)
+            pipe.hset(LOT_AVAILABLE_KEY, mapping=available)
+            pipe.expire(LOT_RECORDS_KEY, LOT_CACHE_TTL)
+            pipe.expire(LOT_AVAILABLE_KEY, LOT_AVAILABLE_TTL)
+        pipe.setex(LOT_CACHE_BUILT_KEY, LOT_CACHE_TTL, 1)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+    broadcast_invalidation(LOT_RECORDS_KEY)
+
+    return lots_data
+
+def cache_lot(lot):
+    """Write a lot's record and committed availability through to the cache after a create or update"""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(LOT_RECORDS_KEY, lot.id, json.dumps(lot_record(lot)))
+        pipe.hset(LOT_AVAILABLE_KEY, lot.id, lot.available_spots)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+    broadcast_invalidation(LOT_RECORDS_KEY)
+
+def uncache_lot(lot_id):
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hdel(LOT_RECORDS_KEY, lot_id)
+        pipe.hdel(LOT_AVAILABLE_KEY, lot_id)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+    broadcast_invalidation(LOT_RECORDS_KEY)
+
+def invalidate_lot_views(lot_id):
+    """Drop cached views derived from a lot's spots after a booking, release or lot change"""
+    cache_delete(get_cache_key('lot_reservations', lot_id), local=True)
+    cache_delete(get_cache_key('admin_dashboard'), local=True)
+
+def publish_cached_availability(lot_id, available):
+    """Overwrite the cached availability of a lot with the counter returned by its booking or release"""
+    try:
+        _publish_lot_availability(keys=[LOT_AVAILABLE_KEY], args=[lot_id, available])
+    except redis.RedisError:
+        pass
+
+# === Statistics rollups ===
+# Upper bounds in hours of the duration buckets kept in DurationRollup:
+# <1h, 1-3h, 3-6h and 6h+
+DURATION_BUCKET_EDGES = (1, 3, 6)
+
+def duration_bucket(seconds, edges=DURATION_BUCKET_EDGES):
+    """Bucket of a stay given in whole seconds, matching duration_bucket_case"""
+    return bisect.bisect_right([edge * 3600 for edge in edges], seconds)
+
+def duration_bucket_case(edges=DURATION_BUCKET_EDGES):
+    """SQL expression giving the duration bucket of a finished reservation.
+
+    The duration is rounded to whole seconds and compared against the edges in
+    seconds, since julianday differences are floats that land just under an
+    exact edge (a 1h stay would otherwise fall in the <1h bucket).
+    """
+    from sqlalchemy import func
+
+    seconds = func.round(
+        (func.julianday(Reservation.leaving_timestamp) - func.julianday(Reservation.parking_timestamp)) * 86400
+    )
+    return db.case(
+        *[(seconds < edge * 3600, i) for i, edge in enumerate(edges)],
+        else_=len(edges)
+    )
+
+def duration_labels(edges=DURATION_BUCKET_EDGES):
+    """Chart labels for the buckets, e.g. ['<1h', '1-3h', '3-6h', '6h+']"""
+    fmt = lambda edge: f"{edge:g}"
+    labels = [f"<{fmt(edges[0])}h"]
+    labels += [f"{fmt(low)}-{fmt(high)}h" for low, high in zip(edges, edges[1:])]
+    labels.append(f"{fmt(edges[-1])}h+")
+    return labels
+
+def parse_bucket_edges(raw):
+    """Parse a '1,3,6' style list of bucket edges in hours, raises ValueError"""
+    edges = tuple(float(part) for part in raw.split(',') if part.strip())
+    if not edges or len(edges) > 12:
+        raise ValueError('Between 1 and 12 bucket edges are required')
+    if any(edge <= 0 for edge in edges) or list(edges) != sorted(set(edges)):
+        raise ValueError('Bucket edges must be positive and strictly increasing')
+    return edges
+
+def duration_histogram(user_id, edges=DURATION_BUCKET_EDGES):
+    """Count a user's finished reservations per duration bucket in one grouped query"""
+    from sqlalchemy import func
+
+    if tuple(edges) == DURATION_BUCKET_EDGES:
+        rows = db.session.query(DurationRollup.bucket, DurationRollup.count).filter_by(user_id=user_id)
+    else:
+        bucket = duration_bucket_case(edges).label('bucket')
+        rows = db.session.query(bucket, func.count(Reservation.id)).filter(
+            Reservation.user_id == user_id,
+            Reservation.status.in_(['completed', 'parked out']),
+            Reservation.leaving_timestamp.isnot(None),
+            Reservation.parking_timestamp.isnot(None)
+        ).group_by('bucket')
+
+    counts = [0] * (len(edges) + 1)
+    for bucket, count in rows:
+        counts[bucket] = count
+    return counts
+
+def rollup_rows(lot_id, user_id, when, reservations=0, completed=0, revenue=0.0):
+    """Day and month StatRollup increments for the whole site, one lot and one user"""
+    day = when.date() if isinstance(when, datetime) else when
+    return [
+        {
+            'scope': scope, 'scope_id': scope_id, 'period': period, 'period_start': start,
+            'reservations': reservations, 'completed': completed, 'revenue': revenue
+        }
+        for scope, scope_id in (('all', 0), ('lot', lot_id), ('user', user_id))
+        for period, start in (('day', day), ('month', day.replace(day=1)))
+    ]
+
+# The rollup SQL (ON CONFLICT upserts, date() and julianday()) is SQLite
+# specific, like the rest of the app
+def upsert_rollups(rows):
+    """Add rollup increments onto existing rows, inserting the rows that are missing"""
+    if not rows:
+        return
+    stmt = sqlite_insert(StatRollup).values(rows)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['scope', 'scope_id', 'period', 'period_start'],
+        set_={
+            'reservations': StatRollup.reservations + stmt.excluded.reservations,
+            'completed': StatRollup.completed + stmt.excluded.completed,
+            'revenue': StatRollup.revenue + stmt.excluded.revenue
+        }
+    ))
+
+def upsert_duration_rollups(rows):
+    if not rows:
+        return
+    stmt = sqlite_insert(DurationRollup).values(rows)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'bucket'],
+        set_={'count': DurationRollup.count + stmt.excluded.count}
+    ))
+
+def record_booking_rollups(lot_id, user_id, parking_time):
+    upsert_rollups(rollup_rows(lot_id, user_id, parking_time, reservations=1))
+
+def record_release_rollups(lot_id, user_id, parking_time, leaving_time, cost):
+    upsert_rollups(rollup_rows(lot_id, user_id, leaving_time, completed=1, revenue=cost or 0.0))
+    seconds = round((leaving_time - parking_time).total_seconds())
+    upsert_duration_rollups([{'user_id': user_id, 'bucket': duration_bucket(seconds), 'count': 1}])
+
+def reservation_rollups(lot_id=None, spot_ids=None):
+    """Aggregate the reservation table into StatRollup rows, optionally for one lot or some of its spots"""
+    from sqlalchemy import func
+
+    totals = {}
+
+    def add(rows):
+        for row in rows:
+            key = (row['scope'], row['scope_id'], row['period'], row['period_start'])
+            if key not in totals:
+                totals[key] = row
             else:
-                res.total_hours = 1.0
-                breakdown = {
-                    'base_cost': lot_price,
-                    'hourly_rate': lot_price,
-                    'total_hours': 1.0,
-                    'additional_hours': 0,
-                    'additional_cost': 0,
-                    'total_cost': lot_price
-                }
-                res.cost_breakdown = json.dumps(breakdown)
-                res.parking_cost = lot_price
-    
+                totals[key]['reservations'] += row['reservations']
+                totals[key]['completed'] += row['completed']
+                totals[key]['revenue'] += row['revenue']
+
+    started = db.session.query(
+        ParkingSpot.lot_id,
+        Reservation.user_id,
+        func.date(Reservation.parking_timestamp).label('day'),
+        func.count(Reservation.id).label('count')
+    ).join(
+        ParkingSpot, Reservation.spot_id == ParkingSpot.id
+    ).filter(
+        Reservation.parking_timestamp.isnot(None)
+    ).group_by(ParkingSpot.lot_id, Reservation.user_id, 'day')
+    if lot_id is not None:
+        started = started.filter(ParkingSpot.lot_id == lot_id)
+    if spot_ids is not None:
+        started = started.filter(Reservation.spot_id.in_(spot_ids))
+
+    for row in started:
+        add(rollup_rows(row.lot_id, row.user_id, date.fromisoformat(row.day), reservations=row.count))
+
+    finished = db.session.query(
+        ParkingSpot.lot_id,
+        Reservation.user_id,
+        func.date(Reservation.leaving_timestamp).label('day'),
+        func.count(Reservation.id).label('count'),
+        func.coalesce(func.sum(Reservation.parking_cost), 0).label('revenue')
+    ).join(
+        ParkingSpot, Reservation.spot_id == ParkingSpot.id
+    ).filter(
+        Reservation.status.in_(['completed', 'parked out']),
+        Reservation.leaving_timestamp.isnot(None)
+    ).group_by(ParkingSpot.lot_id, Reservation.user_id, 'day')
+    if lot_id is not None:
+        finished = finished.filter(ParkingSpot.lot_id == lot_id)
+    if spot_ids is not None:
+        finished = finished.filter(Reservation.spot_id.in_(spot_ids))
+
+    for row in finished:
+        add(rollup_rows(row.lot_id, row.user_id, date.fromisoformat(row.day),
+                        completed=row.count, revenue=float(row.revenue)))
+
+    return list(totals.values())
+
+def reservation_duration_rollups(lot_id=None, spot_ids=None):
+    """Aggregate finished reservations into DurationRollup rows, optionally for one lot or some of its spots"""
+    from sqlalchemy import func
+
+    bucket = duration_bucket_case().label('bucket')
+    durations = db.session.query(
+        Reservation.user_id, bucket, func.count(Reservation.id).label('count')
+    ).filter(
+        Reservation.status.in_(['completed', 'parked out']),
+        Reservation.leaving_timestamp.isnot(None),
+        Reservation.parking_timestamp.isnot(None)
+    ).group_by(Reservation.user_id, 'bucket')
+    if lot_id is not None:
+        durations = durations.join(
+            ParkingSpot, Reservation.spot_id == ParkingSpot.id
+        ).filter(ParkingSpot.lot_id == lot_id)
+    if spot_ids is not None:
+        durations = durations.filter(Reservation.spot_id.in_(spot_ids))
+
+    return [{'user_id': row.user_id, 'bucket': row.bucket, 'count': row.count} for row in durations]
+
+def backfill_rollups():
+    """Rebuild every rollup from the reservation table, returns the number of rollup rows"""
+    StatRollup.query.delete()
+    DurationRollup.query.delete()
+
+    rows = reservation_rollups()
+    for i in range(0, len(rows), 500):
+        upsert_rollups(rows[i:i + 500])
+
+    durations = reservation_duration_rollups()
+    upsert_duration_rollups(durations)
+
+    return len(rows) + len(durations)
+
+def remove_lot_rollups(lot_id, spot_ids=None):
+    """Take reservations back out of the rollups before they are deleted with their lot or spots.
+
+    Covers the whole lot, or only the given spot ids when a lot shrinks. Their
+    contributions are subtracted from the site, lot and user rows, leaving the
+    tables as a backfill would rebuild them. Must run before the deletes are
+    flushed, since it reads the reservations being removed.
+    """
+    rows = [
+        dict(row, reservations=-row['reservations'], completed=-row['completed'], revenue=-row['revenue'])
+        for row in reservation_rollups(lot_id, spot_ids)
+    ]
+    for i in range(0, len(rows), 500):
+        upsert_rollups(rows[i:i + 500])
+    upsert_duration_rollups([
+        dict(row, count=-row['count']) for row in reservation_duration_rollups(lot_id, spot_ids)
+    ])
+
+    # A backfill never writes empty rows, so drop the ones the subtraction emptied
+    StatRollup.query.filter(StatRollup.reservations == 0, StatRollup.completed == 0).delete()
+    DurationRollup.query.filter(DurationRollup.count == 0).delete()
+
+# Default look-back window of the time-weighted utilization mode
+UTILIZATION_WINDOW_HOURS = 24
+
+def snapshot_utilization():
+    """(lot name, occupied %) per lot right now, from one grouped spot count"""
+    from sqlalchemy import func
+
+    occupied = func.count(db.case((ParkingSpot.status == 'O', 1)))
+    rows = db.session.query(
+        ParkingLot.prime_location_name, func.count(ParkingSpot.id), occupied
+    ).outerjoin(
+        ParkingSpot, ParkingSpot.lot_id == ParkingLot.id
+    ).group_by(ParkingLot.id).order_by(ParkingLot.id).all()
+
+    return [
+        (name, round(occupied_spots / total_spots * 100, 1) if total_spots else 0)
+        for name, total_spots, occupied_spots in rows
+    ]
+
+def time_weighted_utilization(window_hours=UTILIZATION_WINDOW_HOURS):
+    """(lot name, occupied %) per lot as occupied spot-hours over spot-hours in the window"""
+    from sqlalchemy import func
+
+    now = datetime.utcnow()
+    start = now - timedelta(hours=window_hours)
+    ended = func.coalesce(Reservation.leaving_timestamp, now)
+
+    # Clip each reservation to the window; min/max are SQLite's scalar forms
+    overlap_hours = (
+        func.julianday(func.min(ended, now)) - func.julianday(func.max(Reservation.parking_timestamp, start))
+    ) * 24
+    occupied = db.select(
+        ParkingSpot.lot_id, func.sum(overlap_hours).label('hours')
+    ).join(
+        ParkingSpot, Reservation.spot_id == ParkingSpot.id
+    ).where(
+        Reservation.parking_timestamp < now,
+        ended > start
+    ).group_by(ParkingSpot.lot_id).subquery()
+
+    rows = db.session.query(
+        ParkingLot.prime_location_name, ParkingLot.number_of_spots, occupied.c.hours
+    ).outerjoin(
+        occupied, occupied.c.lot_id == ParkingLot.id
+    ).order_by(ParkingLot.id).all()
+
+    return [
+        (name, round(min((hours or 0) / (total_spots * window_hours) * 100, 100), 1) if total_spots else 0)
+        for name, total_spots, hours in rows
+    ]
+
+def month_series(scope, scope_id, since):
+    """(label, revenue) per month with releases since the given date, oldest first"""
+    rows = StatRollup.query.filter(
+        StatRollup.scope == scope,
+        StatRollup.scope_id == scope_id,
+        StatRollup.period == 'month',
+        StatRollup.period_start >= since.replace(day=1),
+        StatRollup.completed > 0
+    ).order_by(StatRollup.period_start).all()
+    return [(row.period_start.strftime('%B %Y'), row.revenue) for row in rows]
+
+# === Migrations ===
+# Versioned schema changes for databases created by older releases. Fresh
+# databases get the current schema from db.create_all(), so every migration
+# must be a no-op when its change is already present.
+MIGRATIONS = []
+
+def migration(version, description):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+def add_missing_columns(table, columns):
+    """ALTER TABLE ADD COLUMN for each of {name: ddl} not yet on the table, returns the names added"""
+    existing = {c['name'] for c in db.inspect(db.session.connection()).get_columns(table)}
+    added = []
+    for name, ddl in columns.items():
+        if name not in existing:
+            db.session.execute(db.text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+            added.append(name)
+    return added
+
+@migration(1, 'Add cost breakdown columns to reservation')
+def add_reservation_cost_columns():
+    add_missing_columns('reservation', {
+        'base_cost': 'FLOAT DEFAULT 0.0',
+        'hourly_rate': 'FLOAT DEFAULT 0.0',
+        'total_hours': 'FLOAT DEFAULT 0.0',
+        'cost_breakdown': 'TEXT'
+    })
+
+@migration(2, 'Backfill cost breakdowns of existing reservations')
+def backfill_cost_breakdowns():
+    # Plain SQL rather than the Reservation model, whose columns may be ahead
+    # of this point in the migration history.
+    rows = db.session.execute(db.text(
+        "SELECT reservation.id AS reservation_id, reservation.parking_timestamp, reservation.leaving_timestamp, "
+        "parking_lot.price AS lot_price "
+        "FROM reservation "
+        "JOIN parking_spot ON parking_spot.id = reservation.spot_id "
+        "JOIN parking_lot ON parking_lot.id = parking_spot.lot_id "
+        "WHERE reservation.cost_breakdown IS NULL "
+        "AND (reservation.hourly_rate IS NULL OR reservation.hourly_rate = 0)"
+    ).columns(
+        reservation_id=db.Integer,
+        parking_timestamp=db.DateTime,
+        leaving_timestamp=db.DateTime,
+        lot_price=db.Float
+    )).all()
+
+    updates = []
+    for row in rows:
+        if row.leaving_timestamp:
+            breakdown = build_cost_breakdown(row.lot_price, row.parking_timestamp, row.leaving_timestamp)
+        else:
+            breakdown = {
+                'base_cost': row.lot_price,
+                'hourly_rate': row.lot_price,
+                'total_hours': 1.0,
+                'additional_hours': 0,
+                'additional_cost': 0,
+                'total_cost': row.lot_price
+            }
+        updates.append({
+            'id': row.reservation_id,
+            'rate': row.lot_price,
+            'hours': breakdown['total_hours'],
+            'cost': breakdown['total_cost'],
+            'breakdown': json.dumps(breakdown)
+        })
+
+    if updates:
+        db.session.execute(db.text(
+            "UPDATE reservation SET hourly_rate = :rate, base_cost = :rate, total_hours = :hours, "
+            "parking_cost = :cost, cost_breakdown = :breakdown WHERE id = :id"
+        ), updates)
+    print(f"Migrated {len(updates)} reservations with cost breakdown")
+
+@migration(3, 'Add available_spots counter to parking_lot')
+def add_lot_counters():
+    if not add_missing_columns('parking_lot', {'available_spots': 'INTEGER NOT NULL DEFAULT 0'}):
+        return
+    db.session.execute(db.text(
+        "UPDATE parking_lot SET available_spots = ("
+        "SELECT COUNT(*) FROM parking_spot "
+        "WHERE parking_spot.lot_id = parking_lot.id AND parking_spot.status = 'A')"
+    ))
+
+def create_indexes(model, *names):
+    """Create the named indexes declared on a model (all of them if none given) where missing"""
+    for index in model.__table__.indexes:
+        if not names or index.name in names:
+            index.create(db.session.connection(), checkfirst=True)
+
+@migration(4, 'Index hot query paths')
+def add_hot_path_indexes():
+    create_indexes(ParkingSpot, 'ix_parking_spot_lot_status')
+    create_indexes(
+        Reservation,
+        'ix_reservation_user_status',
+        'ix_reservation_spot_status',
+        'ix_reservation_parking_timestamp'
+    )
+
+@migration(5, 'Index active reservations')
+def add_active_reservation_index():
+    create_indexes(Reservation, 'ix_reservation_active_user')
+
+@migration(6, 'Build statistics rollups')
+def add_statistics_rollups():
+    # The rollup tables themselves are created by db.create_all()
+    print(f"Backfilled {backfill_rollups()} statistics rollup rows")
+
+@migration(7, 'Track reservation changes for incremental exports')
+def add_reservation_updated_at():
+    add_missing_columns('reservation', {'updated_at': 'DATETIME'})
+    db.session.execute(db.text(
+        "UPDATE reservation SET updated_at = COALESCE(leaving_timestamp, parking_timestamp, CURRENT_TIMESTAMP) "
+        "WHERE updated_at IS NULL"
+    ))
+    create_indexes(Reservation, 'ix_reservation_updated_at')
+
+@migration(8, 'Drop the leaving_timestamp index')
+def drop_leaving_timestamp_index():
+    # Revenue windows are read from the rollups now, so no query uses it
+    db.session.execute(db.text("DROP INDEX IF EXISTS ix_reservation_leaving_timestamp"))
+
+def run_migrations():
+    """Apply pending migrations in version order, returns the versions applied"""
+    db.create_all()
+    applied = {version for (version,) in db.session.query(SchemaMigration.version)}
+    done = []
+
+    for version, description, apply in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        apply()
+        db.session.add(SchemaMigration(version=version, description=description))
+        db.session.commit()
+        print(f"Applied migration {version}: {description}")
+        done.append(version)
+
+    return done
+
+_schema_capabilities = None
+
+def schema_capabilities():
+    """Optional schema features present in the database, detected once per process"""
+    global _schema_capabilities
+    if _schema_capabilities is None:
+        columns = {c['name'] for c in db.inspect(db.engine).get_columns('reservation')}
+        _schema_capabilities = {
+            'cost_breakdown': {'base_cost', 'hourly_rate', 'total_hours', 'cost_breakdown'} <= columns
+        }
+        if not _schema_capabilities['cost_breakdown']:
+            print("New columns not found, reservations will be created without cost breakdown")
+    return _schema_capabilities
+
+# Hot queries whose plans must be served by an index, with representative parameters
+HOT_QUERIES = [
+    ('claim_spot candidate',
+     "SELECT id FROM parking_spot WHERE lot_id = :lot_id AND status = 'A' ORDER BY spot_number LIMIT :spread",
+     {'lot_id': 1, 'spread': SPOT_CLAIM_SPREAD}),
+    ('active reservation of a user',
+     "SELECT id FROM reservation WHERE user_id = :user_id AND status = 'active'",
+     {'user_id': 1}),
+    ('active reservation on a spot',
+     "SELECT id FROM reservation WHERE spot_id = :spot_id AND status = 'active'",
+     {'spot_id': 1}),
+    ('reservations newest first',
+     "SELECT id FROM reservation ORDER BY parking_timestamp DESC, id DESC LIMIT 100",
+     {}),
+    ('reservations keyset page',
+     "SELECT id FROM reservation WHERE (parking_timestamp, id) < (:ts, :id) "
+     "ORDER BY parking_timestamp DESC, id DESC LIMIT 100",
+     {'ts': datetime(2024, 1, 1), 'id': 1}),
+    ('active reservation count',
+     "SELECT COUNT(id) FROM reservation WHERE status = 'active'",
+     {}),
+    ('daily booking rollups',
+     "SELECT period_start, reservations FROM stat_rollup "
+     "WHERE scope = 'all' AND scope_id = 0 AND period = 'day' AND period_start >= :since",
+     {'since': date(2024, 1, 1)}),
+    ('monthly revenue rollups',
+     "SELECT period_start, revenue FROM stat_rollup "
+     "WHERE scope = :scope AND scope_id = :scope_id AND period = 'month' AND period_start >= :since "
+     "AND completed > 0 ORDER BY period_start",
+     {'scope': 'user', 'scope_id': 1, 'since': date(2024, 1, 1)}),
+    ('reservations changed since watermark',
+     "SELECT id FROM reservation WHERE (updated_at, id) > (:ts, :id) ORDER BY updated_at, id",
+     {'ts': datetime(2024, 1, 1), 'id': 1}),
+]
+
+def check_query_plans():
+    """EXPLAIN QUERY PLAN each hot query, returns (name, plan lines, uses_index) tuples.
+
+    A plan passes when it reaches rows through an index, never scans a
+    table without one and needs no temporary sort.
+    """
+    results = []
+    for name, sql, params in HOT_QUERIES:
+        plan = [row[-1] for row in db.session.execute(db.text(f"EXPLAIN QUERY PLAN {sql}"), params)]
+        uses_index = (
+            any('USING' in line for line in plan)
+            and not any(line.startswith('SCAN') and 'USING' not in line for line in plan)
+            and not any('TEMP B-TREE' in line for line in plan)
+        )
+        results.append((name, plan, uses_index))
+    return results
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
+    applied = run_migrations()
+    print(f"{len(applied)} migration(s) applied" if applied else "Database is up to date")
+
+@app.cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """Rebuild the statistics rollups from the reservation history."""
+    count = backfill_rollups()
     db.session.commit()
-    print(f"Migrated {len(reservations)} reservations with cost breakdown")
+    print(f"Rebuilt {count} statistics rollup rows")
+
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """Verify that every hot query is served by an index."""
+    failed = False
+    for name, plan, uses_index in check_query_plans():
+        print(f"[{'ok' if uses_index else 'FAIL'}] {name}")
+        for line in plan:
+            print(f"    {line}")
+        failed = failed or not uses_index
+    if failed:
+        raise SystemExit(1)
 
 # === Routes ===
 @app.route('/')
@@ -192,6 +1244,7 @@ def register():
     )
     db.session.add(user)
     db.session.commit()
+    cache_delete(get_cache_key('admin_dashboard'), local=True)
     return jsonify({'message': 'User registered successfully'}), 201
 
 @app.route('/api/login', methods=['POST'])
@@ -199,7 +1252,8 @@ def login():
     data = request.get_json()
     user = User.query.filter_by(username=data['username']).first()
     if user and check_password_hash(user.password_hash, data['password']):
-        token = create_access_token(identity=str(user.id))
+        # The role travels in the token so admin routes need no user lookup
+        token = create_access_token(identity=str(user.id), additional_claims={'role': user.role})
         return jsonify({
             'access_token': token,
             'user': { 'id': user.id, 'username': user.username, 'email': user.email, 'role': user.role }
@@ -208,39 +1262,40 @@ def login():
 
 
 # === ADMIN ROUTES ===
+def build_admin_dashboard():
+    """Dashboard totals in a single round trip.
+
+    Spot totals come from the per-lot counters, so the only tables touched
+    are parking_lot, user and the active-reservation index.
+    """
+    from sqlalchemy import func
+    
+    row = db.session.execute(db.select(
+        db.select(func.count(ParkingLot.id)).scalar_subquery().label('total_lots'),
+        db.select(func.coalesce(func.sum(ParkingLot.number_of_spots), 0)).scalar_subquery().label('total_spots'),
+        db.select(func.coalesce(func.sum(ParkingLot.available_spots), 0)).scalar_subquery().label('available_spots'),
+        db.select(func.count(User.id)).where(User.role == 'user').scalar_subquery().label('total_users'),
+        db.select(func.count(Reservation.id)).where(Reservation.status == 'active').scalar_subquery().label('active_reservations')
+    )).one()
+    
+    return {
+        'total_lots': row.total_lots,
+        'total_spots': row.total_spots,
+        'occupied_spots': row.total_spots - row.available_spots,
+        'available_spots': row.available_spots,
+        'total_users': row.total_users,
+        'active_reservations': row.active_reservations
+    }
+
 @app.route('/api/admin/dashboard', methods=['GET'])
-@jwt_required()
+@admin_required()
 def admin_dashboard():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if user.role != 'admin':
-        return jsonify({'message': 'Admin access required'}), 403
-    
-    total_lots = ParkingLot.query.count()
-    total_spots = ParkingSpot.query.count()
-    occupied_spots = ParkingSpot.query.filter_by(status='O').count()
-    total_users = User.query.filter_by(role='user').count()
-    active_reservations = Reservation.query.filter_by(status='active').count()
-    
-    return jsonify({
-        'total_lots': total_lots,
-        'total_spots': total_spots,
-        'occupied_spots': occupied_spots,
-        'available_spots': total_spots - occupied_spots,
-        'total_users': total_users,
-        'active_reservations': active_reservations
-    })
+    dashboard = cache_fetch(get_cache_key('admin_dashboard'), build_admin_dashboard, expire=10, local=True)
+    return jsonify(dashboard)
 
 @app.route('/api/parking-lots', methods=['POST'])
-@jwt_required()
+@admin_required()
 def create_parking_lot():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if user.role != 'admin':
-        return jsonify({'message': 'Admin access required'}), 403
-    
     data = request.get_json()
     
     lot = ParkingLot(
@@ -248,7 +1303,8 @@ def create_parking_lot():
         price=data['price'],
         address=data['address'],
         pin_code=data['pin_code'],
-        number_of_spots=data['number_of_spots']
+        number_of_spots=data['number_of_spots'],
+        available_spots=data['number_of_spots']
     )
     
     db.session.add(lot)
@@ -260,19 +1316,14 @@ def create_parking_lot():
     
     db.session.commit()
     
-    redis_client.delete(get_cache_key('parking_lots'))
+    cache_lot(lot)
+    invalidate_lot_views(lot.id)
     
     return jsonify({'message': 'Parking lot created successfully'}), 201
 
 @app.route('/api/parking-lots/<int:lot_id>', methods=['PUT'])
-@jwt_required()
+@admin_required()
 def update_parking_lot(lot_id):
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if user.role != 'admin':
-        return jsonify({'message': 'Admin access required'}), 403
-    
     lot = ParkingLot.query.get_or_404(lot_id)
     data = request.get_json()
     
@@ -293,33 +1344,35 @@ def update_parking_lot(lot_id):
             ParkingSpot.spot_number > new_spot_count
         ).all()
         
+        if any(spot.status == 'O' for spot in spots_to_remove):
+            return jsonify({'message': 'Cannot reduce spots with occupied spaces'}), 400
+        
+        # Deleting a spot cascades to its reservations, so take them out of
+        # the rollups first
+        remove_lot_rollups(lot.id, [spot.id for spot in spots_to_remove])
         for spot in spots_to_remove:
-            if spot.status == 'O':
-                return jsonify({'message': 'Cannot reduce spots with occupied spaces'}), 400
             db.session.delete(spot)
     
+    # Added spots start available and only available spots can be removed
+    lot.available_spots = ParkingLot.available_spots + (new_spot_count - current_spot_count)
     lot.number_of_spots = new_spot_count
     db.session.commit()
     
-    redis_client.delete(get_cache_key('parking_lots'))
+    cache_lot(lot)
+    invalidate_lot_views(lot_id)
     
     return jsonify({'message': 'Parking lot updated successfully'})
 
 @app.route('/api/parking-lots/<int:lot_id>', methods=['DELETE'])
-@jwt_required()
+@admin_required()
 def delete_parking_lot(lot_id):
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if user.role != 'admin':
-        return jsonify({'message': 'Admin access required'}), 403
-    
     lot = ParkingLot.query.get_or_404(lot_id)
     
     occupied_spots = ParkingSpot.query.filter_by(lot_id=lot.id, status='O').count()
     if occupied_spots > 0:
         return jsonify({'message': 'Cannot delete lot with occupied spots'}), 400
     
+    remove_lot_rollups(lot.id)
     for spot in lot.spots:
         Reservation.query.filter_by(spot_id=spot.id).delete()
 
@@ -328,233 +1381,288 @@ def delete_parking_lot(lot_id):
     db.session.delete(lot)
     db.session.commit()
     
-    redis_client.delete(get_cache_key('parking_lots'))
+    uncache_lot(lot_id)
+    invalidate_lot_views(lot_id)
     
     return jsonify({'message': 'Parking lot deleted successfully'})
 
-@app.route('/api/all-reservations', methods=['GET'])
-@jwt_required()
-def get_all_reservations():
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-    if user.role != 'admin':
-        return jsonify({'msg': 'Unauthorized'}), 403
-
-    reservations = Reservation.query.order_by(Reservation.parking_timestamp.desc()).all()
-
-    data = []
-    for res in reservations:
-        if res.cost_breakdown:
-            breakdown = json.loads(res.cost_breakdown)
-        else:
-            breakdown = {
-                'total_cost': res.parking_cost or 0,
-                'hourly_rate': res.hourly_rate or 0,
-                'total_hours': res.total_hours or 0
-            }
-
-        if res.status == 'active':
-            current_breakdown = calculate_parking_cost(res, res.hourly_rate)
-            breakdown.update(current_breakdown)
-        
-        data.append({
-            'id': res.id,
-            'username': res.user.username,
-            'lot': res.spot.lot.prime_location_name,
-            'spot_number': res.spot.spot_number,
-            'vehicle_number': res.vehicle_number,
-            'parking_timestamp': res.parking_timestamp.isoformat(),
-            'leaving_timestamp': res.leaving_timestamp.isoformat() if res.leaving_timestamp else None,
-            'parking_cost': res.parking_cost,
-            'status': res.status,
-            'cost_breakdown': breakdown
-        })
+def admin_reservations_query(args):
+    """Newest-first reservations joined to user, spot and lot, with the admin filters applied.
+
+    Supported filters: lot_id, user_id, status and a date_from/date_to range
+    (ISO dates) on the parking timestamp. Raises ValueError on bad input.
+    """
+    query = db.session.query(
+        Reservation, User.username, ParkingSpot.spot_number, ParkingLot.prime_location_name
+    ).join(
+        User, Reservation.user_id == User.id
+    ).join(
+        ParkingSpot, Reservation.spot_id == ParkingSpot.id
+    ).join(
+        ParkingLot, ParkingSpot.lot_id == ParkingLot.id
+    )
 
-    return jsonify(data), 200
+    if args.get('lot_id'):
+        query = query.filter(ParkingSpot.lot_id == int(args['lot_id']))
+    if args.get('user_id'):
+        query = query.filter(Reservation.user_id == int(args['user_id']))
+    if args.get('status'):
+        query = query.filter(Reservation.status == args['status'])
+    if args.get('date_from'):
+        query = query.filter(Reservation.parking_timestamp >= datetime.fromisoformat(args['date_from']))
+    if args.get('date_to'):
+        date_to = datetime.fromisoformat(args['date_to'])
+        if len(args['date_to']) == 10:
+            # A bare date includes the whole day
+            date_to += timedelta(days=1)
+        query = query.filter(Reservation.parking_timestamp < date_to)
+
+    return query.order_by(Reservation.parking_timestamp.desc(), Reservation.id.desc())
+
+def admin_reservation_row(res, username, spot_number, lot_name):
+    return {
+        'id': res.id,
+        'username': username,
+        'lot': lot_name,
+        'spot_number': spot_number,
+        'vehicle_number': res.vehicle_number,
+        'parking_timestamp': res.parking_timestamp.isoformat(),
+        'leaving_timestamp': res.leaving_timestamp.isoformat() if res.leaving_timestamp else None,
+        'parking_cost': res.parking_cost,
+        'status': res.status,
+        'cost_breakdown': reservation_breakdown(res)
+    }
 
-@app.route('/api/reservations/<int:lot_id>', methods=['GET'])
-@jwt_required()
-def get_reservations_by_lot(lot_id):
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-    if user.role != 'admin':
-        return jsonify({'msg': 'Unauthorized'}), 403
+@app.route('/api/all-reservations', methods=['GET'])
+@admin_required({'msg': 'Unauthorized'})
+def get_all_reservations():
+    try:
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+        query = admin_reservations_query(request.args)
+        if request.args.get('cursor'):
+            cursor_ts, cursor_id = decode_cursor(request.args['cursor'])
+            query = query.filter(
+                db.tuple_(Reservation.parking_timestamp, Reservation.id) < (cursor_ts, cursor_id)
+            )
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    # Streamed listings return every matching row, so no limit is applied
+    stream_mode = requested_stream_mode()
+    if stream_mode:
+        return stream_rows(query, admin_reservation_row, stream_mode)
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    data = [admin_reservation_row(*row) for row in rows]
+
+    response = jsonify(data)
+    if has_more:
+        last = rows[-1].Reservation
+        response.headers['X-Next-Cursor'] = encode_cursor(last.parking_timestamp, last.id)
+    return response, 200
+
+def build_lot_occupancy(lot_id):
+    """Spot status summary and current occupants of a lot in a single query"""
+    rows = db.session.query(
+        ParkingSpot.id,
+        ParkingSpot.spot_number,
+        ParkingSpot.status,
+        User.username,
+        Reservation.vehicle_number,
+        Reservation.parking_timestamp,
+        Reservation.leaving_timestamp
+    ).outerjoin(
+        Reservation, db.and_(Reservation.spot_id == ParkingSpot.id, Reservation.status == 'active')
+    ).outerjoin(
+        User, Reservation.user_id == User.id
+    ).filter(
+        ParkingSpot.lot_id == lot_id
+    ).order_by(
+        ParkingSpot.spot_number, ParkingSpot.id, Reservation.parking_timestamp.desc()
+    ).all()
 
-    spots = ParkingSpot.query.filter_by(lot_id=lot_id).all()
     summary = []
     details = []
+    seen_spots = set()
+
+    for row in rows:
+        # Rows are newest reservation first per spot, keep only that one
+        if row.id in seen_spots:
+            continue
+        seen_spots.add(row.id)
 
-    for spot in spots:
         summary.append({
-            'spot_number': spot.spot_number,
-            'status': spot.status  # 'O' or 'A'
+            'spot_number': row.spot_number,
+            'status': row.status  # 'O' or 'A'
         })
 
-        if spot.status == 'O':
-            res = Reservation.query.filter_by(spot_id=spot.id, status='active').order_by(Reservation.parking_timestamp.desc()).first()
-            if res:
-                details.append({
-                    'username': res.user.username,
-                    'spot_number': spot.spot_number,
-                    'vehicle_number': res.vehicle_number,
-                    'parking_timestamp': res.parking_timestamp.isoformat(),
-                    'leaving_timestamp': res.leaving_timestamp.isoformat() if res.leaving_timestamp else None,
-                    'status': 'Occupied'
-                })
+        if row.status == 'O' and row.parking_timestamp:
+            details.append({
+                'username': row.username,
+                'spot_number': row.spot_number,
+                'vehicle_number': row.vehicle_number,
+                'parking_timestamp': row.parking_timestamp.isoformat(),
+                'leaving_timestamp': row.leaving_timestamp.isoformat() if row.leaving_timestamp else None,
+                'status': 'Occupied'
+            })
 
-    return jsonify({
+    return {
         'lot_id': lot_id,
-        'total_spots': len(spots),
+        'total_spots': len(summary),
         'occupied_count': sum(1 for s in summary if s['status'] == 'O'),
         'summary': summary,
         'details': details
-    }), 200
+    }
+
+@app.route('/api/reservations/<int:lot_id>', methods=['GET'])
+@admin_required({'msg': 'Unauthorized'})
+def get_reservations_by_lot(lot_id):
+    occupancy = cache_fetch(
+        get_cache_key('lot_reservations', lot_id),
+        lambda: build_lot_occupancy(lot_id),
+        expire=30,
+        local=True
+    )
+    return jsonify(occupancy), 200
+
+def admin_user_row(u, total_reservations):
+    return {
+        'id': u.id,
+        'username': u.username,
+        'email': u.email,
+        'phone': u.phone,
+        'created_at': u.created_at.isoformat(),
+        'total_reservations': total_reservations
+    }
 
 @app.route('/api/admin/users', methods=['GET'])
-@jwt_required()
+@admin_required()
 def get_all_users():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if user.role != 'admin':
-        return jsonify({'message': 'Admin access required'}), 403
-    
-    users = User.query.filter_by(role='user').all()
-    users_data = []
-    
-    for u in users:
-        users_data.append({
-            'id': u.id,
-            'username': u.username,
-            'email': u.email,
-            'phone': u.phone,
-            'created_at': u.created_at.isoformat(),
-            'total_reservations': len(u.reservations)
-        })
-    
-    return jsonify(users_data)
+    from sqlalchemy import func
+    
+    reservation_counts = db.session.query(
+        Reservation.user_id,
+        func.count(Reservation.id).label('total')
+    ).group_by(Reservation.user_id).subquery()
+    
+    query = db.session.query(
+        User, func.coalesce(reservation_counts.c.total, 0)
+    ).outerjoin(
+        reservation_counts, reservation_counts.c.user_id == User.id
+    ).filter(User.role == 'user').order_by(User.id)
+    
+    stream_mode = requested_stream_mode()
+    if stream_mode:
+        return stream_rows(query, admin_user_row, stream_mode)
+    
+    return jsonify([admin_user_row(*row) for row in query.all()])
+
+
+def build_admin_statistics(utilization_mode='snapshot', window_hours=UTILIZATION_WINDOW_HOURS):
+    """Revenue, utilization and booking trend series for the admin charts"""
+    six_months_ago = datetime.now() - timedelta(days=180)
+
+    # Revenue by month from the site-wide monthly rollups
+    revenue_data = month_series('all', 0, six_months_ago.date())
+
+    months = []
+    revenue = []
+
+    if not revenue_data:
+        # Provide sample months if no data
+        current_date = datetime.now()
+        for i in range(6):
+            month_date = current_date - timedelta(days=30*i)
+            months.insert(0, month_date.strftime('%B %Y'))
+            revenue.insert(0, 0)
+    else:
+        for month_str, total_revenue in revenue_data:
+            months.append(month_str)
+            revenue.append(float(total_revenue or 0))
+
+    # Parking lot utilization
+    if utilization_mode == 'time_weighted':
+        utilization_data = time_weighted_utilization(window_hours)
+    else:
+        utilization_data = snapshot_utilization()
+
+    if not utilization_data:
+        lot_names = ['No Lots Available']
+        utilization_rates = [0]
+    else:
+        lot_names = [name for name, _ in utilization_data]
+        utilization_rates = [rate for _, rate in utilization_data]
+
+    seven_days_ago = datetime.now() - timedelta(days=7)
+
+    daily_reservations = StatRollup.query.filter(
+        StatRollup.scope == 'all',
+        StatRollup.scope_id == 0,
+        StatRollup.period == 'day',
+        StatRollup.period_start >= seven_days_ago.date()
+    ).all()
 
+    reservation_dict = {
+        row.period_start.strftime('%m/%d'): row.reservations for row in daily_reservations
+    }
+
+    days = []
+    reservation_counts = []
+
+    for i in range(7):
+        day_date = datetime.now() - timedelta(days=6-i)
+        day_str = day_date.strftime('%m/%d')
+        days.append(day_str)
+
+        count = reservation_dict.get(day_str, 0)
+        reservation_counts.append(count)
+
+    return {
+        'revenue': {
+            'months': months,
+            'revenue': revenue
+        },
+        'utilization': {
+            'mode': utilization_mode,
+            'lots': lot_names,
+            'utilization': utilization_rates
+        },
+        'trends': {
+            'days': days,
+            'reservations': reservation_counts
+        }
+    }
 
 @app.route('/api/admin/statistics', methods=['GET'])
-@jwt_required()
+@admin_required()
 def admin_statistics():
+    mode = request.args.get('utilization', 'snapshot')
+    if mode not in ('snapshot', 'time_weighted'):
+        return jsonify({'message': "utilization must be 'snapshot' or 'time_weighted'"}), 400
+
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        if not user or user.role != 'admin':
-            return jsonify({'message': 'Admin access required'}), 403
-        
-        from sqlalchemy import func, extract
-        from datetime import datetime, timedelta
-        
-        six_months_ago = datetime.now() - timedelta(days=180)
-        
-        # Revenue by month - only get completed reservations with cost
-        revenue_data = db.session.query(
-            extract('month', Reservation.leaving_timestamp).label('month'),
-            extract('year', Reservation.leaving_timestamp).label('year'),
-            func.sum(Reservation.parking_cost).label('total_revenue')
-        ).filter(
-            Reservation.leaving_timestamp >= six_months_ago,
-            Reservation.status.in_(['completed', 'parked out']),
-            Reservation.parking_cost.isnot(None)
-        ).group_by(
-            extract('year', Reservation.leaving_timestamp),
-            extract('month', Reservation.leaving_timestamp)
-        ).order_by(
-            extract('year', Reservation.leaving_timestamp),
-            extract('month', Reservation.leaving_timestamp)
-        ).all()
-        
-        months = []
-        revenue = []
-        
-        if not revenue_data:
-            # Provide sample months if no data
-            current_date = datetime.now()
-            for i in range(6):
-                month_date = current_date - timedelta(days=30*i)
-                months.insert(0, month_date.strftime('%B %Y'))
-                revenue.insert(0, 0)
-        else:
-            for row in revenue_data:
-                month_num = int(row.month)
-                year_num = int(row.year)
-                
-                date_obj = datetime(year_num, month_num, 1)
-                month_str = date_obj.strftime('%B %Y')
-                
-                months.append(month_str)
-                revenue.append(float(row.total_revenue or 0))
-        
-        # Parking lot utilization
-        lots = ParkingLot.query.all()
-        lot_names = []
-        utilization_rates = []
-        
-        if not lots:
-            lot_names = ['No Lots Available']
-            utilization_rates = [0]
+        window_hours = float(request.args.get('window_hours', UTILIZATION_WINDOW_HOURS))
+    except ValueError:
+        return jsonify({'message': 'window_hours must be a number'}), 400
+    if not 0 < window_hours <= 24 * 90:
+        return jsonify({'message': 'window_hours must be between 0 and 2160'}), 400
+
+    try:
+        if mode == 'snapshot':
+            cache_key = get_cache_key('admin_statistics')
         else:
-            for lot in lots:
-                total_spots = lot.number_of_spots
-                occupied_spots = ParkingSpot.query.filter_by(lot_id=lot.id, status='O').count()
-                utilization = (occupied_spots / total_spots * 100) if total_spots > 0 else 0
-                
-                lot_names.append(lot.prime_location_name)
-                utilization_rates.append(round(utilization, 1))
-        
-        seven_days_ago = datetime.now() - timedelta(days=7)
-        
-        daily_reservations = db.session.query(
-            func.date(Reservation.parking_timestamp).label('date'),
-            func.count(Reservation.id).label('count')
-        ).filter(
-            Reservation.parking_timestamp >= seven_days_ago
-        ).group_by(
-            func.date(Reservation.parking_timestamp)
-        ).order_by('date').all()
-        
-        reservation_dict = {}
-        for row in daily_reservations:
-            try:
-                if hasattr(row.date, 'strftime'):
-                    date_str = row.date.strftime('%m/%d')
-                else:
-                    from datetime import datetime
-                    parsed_date = datetime.strptime(str(row.date), '%Y-%m-%d')
-                    date_str = parsed_date.strftime('%m/%d')
-                reservation_dict[date_str] = row.count
-            except Exception as e:
-                print(f"Error processing date {row.date}: {e}")
-                continue
-        
-        days = []
-        reservation_counts = []
-        
-        for i in range(7):
-            day_date = datetime.now() - timedelta(days=6-i)
-            day_str = day_date.strftime('%m/%d')
-            days.append(day_str)
-            
-            count = reservation_dict.get(day_str, 0)
-            reservation_counts.append(count)
-        
-        return jsonify({
-            'revenue': {
-                'months': months,
-                'revenue': revenue
-            },
-            'utilization': {
-                'lots': lot_names,
-                'utilization': utilization_rates
-            },
-            'trends': {
-                'days': days,
-                'reservations': reservation_counts
-            }
-        })
+            cache_key = get_cache_key('admin_statistics', mode, f"{window_hours:g}")
+
+        stats = cache_fetch(
+            cache_key,
+            lambda: build_admin_statistics(mode, window_hours),
+            expire=60,
+            local=True
+        )
+        return jsonify(stats)
         
     except Exception as e:
         print(f"Admin statistics error: {str(e)}")
@@ -567,28 +1675,11 @@ def admin_statistics():
 @app.route('/api/parking-lots', methods=['GET'])
 @jwt_required()
 def get_parking_lots():
-    cache_key = get_cache_key('parking_lots')
-    cached_data = cache_get(cache_key)
-    
-    if cached_data:
-        return jsonify(cached_data)
-    
-    lots = ParkingLot.query.all()
-    lots_data = []
+    lots_data = load_lot_cache()
     
-    for lot in lots:
-        available_spots = ParkingSpot.query.filter_by(lot_id=lot.id, status='A').count()
-        lots_data.append({
-            'id': lot.id,
-            'prime_location_name': lot.prime_location_name,
-            'price': lot.price,
-            'address': lot.address,
-            'pin_code': lot.pin_code,
-            'number_of_spots': lot.number_of_spots,
-            'available_spots': available_spots
-        })
+    if lots_data is None:
+        lots_data = single_flight(LOT_CACHE_BUILT_KEY, load_lot_cache, rebuild_lot_cache)
     
-    cache_set(cache_key, lots_data, 60)
     return jsonify(lots_data)
     
 @app.route('/api/reserve-spot', methods=['POST'])
@@ -614,30 +1705,34 @@ def reserve_spot():
     except Exception as e:
         print(f"Error checking existing reservations: {e}")
     
-    spot = ParkingSpot.query.filter_by(lot_id=lot_id, status='A').first()
-    if not spot:
-        return jsonify({'message': 'No available spots'}), 400
-    
     lot = ParkingLot.query.get(lot_id)
     if not lot:
         return jsonify({'message': 'Parking lot not found'}), 404
 
     try:
+        spot = claim_spot(lot_id)
+    except SpotContention:
+        db.session.rollback()
+        response = jsonify({'message': 'Spots are being booked right now, please try again'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    if not spot:
+        db.session.rollback()
+        return jsonify({'message': 'No available spots'}), 400
+
+    try:
+        parking_time = datetime.utcnow()
         reservation_data = {
             'spot_id': spot.id,
             'user_id': user_id,
             'vehicle_number': vehicle_number,
+            'parking_timestamp': parking_time,
             'parking_cost': lot.price,  # Set basic cost
             'status': 'active'
         }
         
-        try:
-            db.session.execute(db.text("SELECT base_cost FROM reservation LIMIT 1"))
-            temp_reservation = type('obj', (object,), {
-                'parking_timestamp': datetime.utcnow()
-            })()
-            
-            initial_breakdown = calculate_parking_cost(temp_reservation, lot.price, temp_reservation.parking_timestamp)
+        if schema_capabilities()['cost_breakdown']:
+            initial_breakdown = build_cost_breakdown(lot.price, parking_time, parking_time)
             
             reservation_data.update({
                 'hourly_rate': lot.price,
@@ -645,17 +1740,15 @@ def reserve_spot():
                 'total_hours': 1.0,
                 'cost_breakdown': json.dumps(initial_breakdown)
             })
-        except Exception:
-            print("New columns not found, creating basic reservation")
         
         reservation = Reservation(**reservation_data)
         
-        spot.status = 'O'
-        
         db.session.add(reservation)
+        record_booking_rollups(lot.id, int(user_id), parking_time)
         db.session.commit()
         
-        redis_client.delete(get_cache_key('parking_lots'))
+        publish_cached_availability(lot.id, spot.available_spots)
+        invalidate_lot_views(lot.id)
         
         return jsonify({
             'message': 'Spot reserved successfully',
@@ -683,33 +1776,51 @@ def release_spot(reservation_id):
     if reservation.user_id != int(user_id):
         return jsonify({'message': 'Unauthorized'}), 403
     
-    if reservation.status == 'completed':
+    if reservation.status in ('completed', 'parked out'):
         return jsonify({'message': 'Spot already released'}), 400
     
     leaving_time = datetime.utcnow()
-    reservation.leaving_timestamp = leaving_time
-
     cost_breakdown = calculate_parking_cost(reservation, reservation.hourly_rate, leaving_time)
-
-    reservation.leaving_timestamp = datetime.utcnow()
-    duration = (reservation.leaving_timestamp - reservation.parking_timestamp).total_seconds() / 3600
-
-    reservation.parking_cost = cost_breakdown['total_cost']
-    
-    reservation.total_hours = cost_breakdown['total_hours']
-    reservation.cost_breakdown = json.dumps(cost_breakdown)
-    reservation.status = 'parked out'
+    duration = (leaving_time - reservation.parking_timestamp).total_seconds() / 3600
+    
+    # The status flip is conditional so that of two concurrent releases only
+    # one wins, and only the winner frees the spot and counts the release
+    released = db.session.execute(
+        db.update(Reservation).where(
+            Reservation.id == reservation.id,
+            Reservation.status == 'active'
+        ).values(
+            status='parked out',
+            leaving_timestamp=leaving_time,
+            parking_cost=cost_breakdown['total_cost'],
+            total_hours=cost_breakdown['total_hours'],
+            cost_breakdown=json.dumps(cost_breakdown)
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+    if not released:
+        db.session.rollback()
+        return jsonify({'message': 'Spot already released'}), 400
     
-    reservation.spot.status = 'A'
+    freed = free_spot(reservation.spot_id)
+    record_release_rollups(
+        freed.lot_id if freed else reservation.spot.lot_id,
+        reservation.user_id,
+        reservation.parking_timestamp,
+        leaving_time,
+        cost_breakdown['total_cost']
+    )
     
     db.session.commit()
     
-    redis_client.delete(get_cache_key('parking_lots'))
+    if freed:
+        publish_cached_availability(freed.lot_id, freed.available_spots)
+        invalidate_lot_views(freed.lot_id)
+    cache_delete(get_cache_key('user_statistics', user_id), local=True)
     
     return jsonify({
         'message': 'Spot released successfully',
         'cost_breakdown': cost_breakdown,
-        'total_cost': reservation.parking_cost,
+        'total_cost': cost_breakdown['total_cost'],
         'duration_hours': duration
     })
 
@@ -724,19 +1835,7 @@ def get_user_reservations():
     reservations_data = []
     for res in reservations:
         try:
-            if res.cost_breakdown:
-                breakdown = json.loads(res.cost_breakdown)
-            else:
-                breakdown = {
-                    'total_cost': res.parking_cost or 0,
-                    'hourly_rate': res.hourly_rate or 0,
-                    'total_hours': res.total_hours or 0
-                }
-
-            if res.status == 'active':
-                current_breakdown = calculate_parking_cost(res, res.hourly_rate)
-                breakdown.update(current_breakdown)
-
+            breakdown = reservation_breakdown(res)
         except Exception as e:
             breakdown = {
                 'base_cost': res.parking_cost or 0,
@@ -761,103 +1860,69 @@ def get_user_reservations():
     
     return jsonify(reservations_data)
 
+def build_user_statistics(user_id, edges=DURATION_BUCKET_EDGES):
+    """Monthly spending and parking duration distribution for one user"""
+    # User monthly spending (last 6 months) from the user's monthly rollups
+    six_months_ago = datetime.now() - timedelta(days=180)
+    spending_data = month_series('user', int(user_id), six_months_ago.date())
+
+    months = []
+    spending = []
+
+    # If no spending data, provide default values for last 6 months
+    if not spending_data:
+        current_date = datetime.now()
+        for i in range(6):
+            month_date = current_date - timedelta(days=30*i)
+            month_name = month_date.strftime('%B %Y')
+            months.insert(0, month_name)
+            spending.insert(0, 0)
+    else:
+        for month_name, total_spent in spending_data:
+            months.append(month_name)
+            spending.append(float(total_spent or 0))
+
+    # User parking duration distribution, all zeros shows "No data"
+    duration_buckets = duration_histogram(int(user_id), edges)
+
+    return {
+        'spending': {
+            'months': months,
+            'spending': spending
+        },
+        'duration': {
+            'labels': duration_labels(edges),
+            'durations': duration_buckets
+        }
+    }
+
 @app.route('/api/user/statistics', methods=['GET'])
 @jwt_required()
 def user_statistics():
     try:
         user_id = get_jwt_identity()
-        
-        # User monthly spending (last 6 months)
-        from datetime import datetime, timedelta
-        from sqlalchemy import func, extract
-        
-        six_months_ago = datetime.now() - timedelta(days=180)
-        
-        # Get spending data for completed reservations
-        spending_data = db.session.query(
-            extract('month', Reservation.leaving_timestamp).label('month'),
-            extract('year', Reservation.leaving_timestamp).label('year'),
-            func.sum(Reservation.parking_cost).label('total_spent')
-        ).filter(
-            Reservation.user_id == user_id,
-            Reservation.leaving_timestamp >= six_months_ago,
-            Reservation.status.in_(['completed', 'parked out']),
-            Reservation.parking_cost.isnot(None)
-        ).group_by(
-            extract('year', Reservation.leaving_timestamp),
-            extract('month', Reservation.leaving_timestamp)
-        ).order_by(
-            extract('year', Reservation.leaving_timestamp),
-            extract('month', Reservation.leaving_timestamp)
-        ).all()
-        
-        months = []
-        spending = []
-        
-        # If no spending data, provide default values for last 6 months
-        if not spending_data:
-            current_date = datetime.now()
-            for i in range(6):
-                month_date = current_date - timedelta(days=30*i)
-                month_name = month_date.strftime('%B %Y')
-                months.insert(0, month_name)
-                spending.insert(0, 0)
+
+        edges = DURATION_BUCKET_EDGES
+        if request.args.get('buckets'):
+            try:
+                edges = parse_bucket_edges(request.args['buckets'])
+            except ValueError as e:
+                return jsonify({'message': f'Invalid buckets: {e}'}), 400
+
+        # Default buckets share the key that release_spot invalidates,
+        # custom ones are cached per edge list and simply expire
+        if edges == DURATION_BUCKET_EDGES:
+            cache_key = get_cache_key('user_statistics', user_id)
         else:
-            for row in spending_data:
-                try:
-                    month_date = datetime(int(row.year), int(row.month), 1)
-                    month_name = month_date.strftime('%B %Y')
-                    months.append(month_name)
-                    spending.append(float(row.total_spent or 0))
-                except Exception as e:
-                    print(f"Error processing spending row: {e}")
-                    continue
-        
-        # User parking duration distribution - get ALL user reservations
-        user_reservations = Reservation.query.filter(
-            Reservation.user_id == user_id,
-            Reservation.status.in_(['completed', 'parked out']),
-            Reservation.leaving_timestamp.isnot(None),
-            Reservation.parking_timestamp.isnot(None)
-        ).all()
-        
-        duration_buckets = [0, 0, 0, 0]  # <1h, 1-3h, 3-6h, 6+h
-        
-        print(f"User {user_id} has {len(user_reservations)} completed reservations")
-        
-        if user_reservations:
-            for reservation in user_reservations:
-                try:
-                    duration_hours = (reservation.leaving_timestamp - reservation.parking_timestamp).total_seconds() / 3600
-                    print(f"Reservation {reservation.id}: {duration_hours:.2f} hours")
-                    
-                    if duration_hours < 1:
-                        duration_buckets[0] += 1
-                    elif duration_hours < 3:
-                        duration_buckets[1] += 1
-                    elif duration_hours < 6:
-                        duration_buckets[2] += 1
-                    else:
-                        duration_buckets[3] += 1
-                except Exception as e:
-                    print(f"Error calculating duration for reservation {reservation.id}: {e}")
-                    continue
-        
-        print(f"Duration buckets: {duration_buckets}")
-        
-        # If all buckets are 0, show message data
-        if sum(duration_buckets) == 0:
-            duration_buckets = [0, 0, 0, 0]  # All zeros to show "No data"
-        
-        return jsonify({
-            'spending': {
-                'months': months,
-                'spending': spending
-            },
-            'duration': {
-                'durations': duration_buckets
-            }
-        })
+            cache_key = get_cache_key('user_statistics', user_id, ','.join(f"{edge:g}" for edge in edges))
+
+        stats = cache_fetch(
+            cache_key,
+            lambda: build_user_statistics(user_id, edges),
+            expire=60,
+            local=True
+        )
+        return jsonify(stats)
         
     except Exception as e:
         print(f"User statistics error: {str(e)}")
@@ -868,28 +1933,17 @@ def user_statistics():
 
 # === REDIS ROUTES ===
 @app.route('/api/cache-status', methods=['GET'])
-@jwt_required()
+@admin_required()
 def get_cache_status():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if user.role != 'admin':
-        return jsonify({'message': 'Admin access required'}), 403
-    
     return jsonify({
-        'parkingLots': redis_client.exists(get_cache_key('parking_lots'))
+        'parkingLots': redis_client.exists(LOT_CACHE_BUILT_KEY)
     })
 
 @app.route('/api/clear-cache', methods=['POST'])
-@jwt_required()
+@admin_required()
 def clear_cache():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if user.role != 'admin':
-        return jsonify({'message': 'Admin access required'}), 403
-    
     redis_client.flushdb()
+    broadcast_invalidation('*')
     return jsonify({'message': 'Cache cleared successfully'})
 
 
@@ -897,6 +1951,20 @@ def clear_cache():
 @app.route('/api/download-csv/<download_key>', methods=['GET'])
 @jwt_required()
 def download_csv(download_key):
+    export = cache_get(get_cache_key('export', download_key))
+    if export:
+        if export['user_id'] != int(get_jwt_identity()) and current_role() != 'admin':
+            return jsonify({'message': 'Unauthorized'}), 403
+        if not os.path.exists(export['path']):
+            return jsonify({'message': 'File not found or expired'}), 404
+        return send_file(
+            export['path'],
+            mimetype=export['mimetype'],
+            as_attachment=True,
+            download_name=export['filename']
+        )
+
+    # Exports queued before the move to export files kept the CSV in Redis
     csv_data = cache_get(download_key)
     if not csv_data:
         return jsonify({'message': 'File not found or expired'}), 404
@@ -911,16 +1979,34 @@ def download_csv(download_key):
 @jwt_required()
 def export_csv():
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
     
-    from celery_app import export_user_data_csv
-    task = export_user_data_csv.delay(user_id)
+    data = request.get_json(silent=True) or {}
+    
+    from celery_app import export_user_data_csv, export_format_available, parse_watermark, EXPORT_FORMATS
+    since = data.get('since')
+    if since:
+        try:
+            parse_watermark(since)
+        except ValueError:
+            return jsonify({'message': "since must be a watermark like '2024-01-31T18:00:00,1234'"}), 400
+    
+    export_format = data.get('format') or ('csv.gz' if data.get('compress') else 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({
+            'message': f"Unknown export format, choose one of: {', '.join(EXPORT_FORMATS)}"
+        }), 400
+    if not export_format_available(export_format):
+        return jsonify({'message': f'Export format {export_format} is not available on this server'}), 400
+    
+    task = export_user_data_csv.delay(user_id, export_format=export_format, since=since)
     
     return jsonify({
         'message': 'Export job started',
         'task_id': task.id,
+        'format': export_format,
+        'since': since,
         'user_id': user_id,
-        'user_role': user.role
+        'user_role': current_role()
     }), 202
 
 @app.route('/api/task-status/<task_id>', methods=['GET'])
@@ -941,6 +2027,10 @@ def get_task_status(task_id):
                 'progress': task.info.get('progress', 0),
                 'result': None
             }
+            # Throttled reporters also send processed/total, rate (items/s) and eta (s)
+            for key in ('processed', 'total', 'rate', 'eta'):
+                if key in task.info:
+                    response[key] = task.info[key]
         elif task.state == 'SUCCESS':
             response = {
                 'status': task.state,
@@ -972,46 +2062,34 @@ def get_task_status(task_id):
         }), 500
 
 @app.route('/api/trigger-reminders', methods=['POST'])
-@jwt_required()
+@admin_required()
 def trigger_reminders():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if user.role != 'admin':
-        return jsonify({'message': 'Admin access required'}), 403
-    
     from celery_app import send_daily_reminders
     task = send_daily_reminders.delay()
     
     return jsonify({
         'task_id': task.id,
-        'user_id': user_id,
-        'user_role': user.role
+        'user_id': get_jwt_identity(),
+        'user_role': 'admin'
     })
 
 @app.route('/api/generate-reports', methods=['POST'])
-@jwt_required()
+@admin_required()
 def trigger_reports():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    
-    if user.role != 'admin':
-        return jsonify({'message': 'Admin access required'}), 403
-    
     from celery_app import generate_monthly_reports
     task = generate_monthly_reports.delay()
     
     return jsonify({
         'task_id': task.id,
-        'user_id': user_id,
-        'user_role': user.role
+        'user_id': get_jwt_identity(),
+        'user_role': 'admin'
     })
     
 
 # === Initialization ===
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        run_migrations()
+        schema_capabilities()
         init_admin()
-        migrate_existing_reservations() 
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file